@@ -0,0 +1,90 @@
+# advertising.py
+"""多个广播实例的注册与轮换
+
+轮换时先注册下一个实例，成功后再注销当前实例，期间始终有广播在空中。
+"""
+import logging
+
+import dbus
+
+import timers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROTATE_MS = 10_000
+NO_OPTIONS = dbus.Dictionary({}, signature="sv")  # 代理未做 Introspect，需显式类型
+
+
+class AdvertisementRotator:
+    """在一个 LEAdvertisingManager1 上按间隔轮流注册多个 Advertisement"""
+
+    def __init__(self, adv_manager, advertisements, interval_ms=DEFAULT_ROTATE_MS):
+        if not advertisements:
+            raise ValueError("至少需要一个广播实例")
+        self.adv_manager = adv_manager
+        self.advertisements = list(advertisements)
+        self.interval_ms = interval_ms
+        self.index = 0
+        self.rotations = 0
+        self._switching = False
+        self._timer = None
+
+    @property
+    def active(self):
+        return self.advertisements[self.index]
+
+    def start(self, reply_handler, error_handler):
+        """注册第一个实例；有多个实例时开始轮换"""
+
+        def registered():
+            self.active.registered = True
+            if len(self.advertisements) > 1:
+                self._timer = timers.call_every(self.interval_ms, self._rotate)
+            reply_handler()
+
+        self._register(self.active, registered, error_handler)
+
+    def stop(self):
+        """停止轮换并同步注销当前实例（退出清理时使用）"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        active = self.active
+        active.registered = False
+        self.adv_manager.UnregisterAdvertisement(active.get_path())
+
+    def _register(self, adv, reply_handler, error_handler):
+        self.adv_manager.RegisterAdvertisement(
+            adv.get_path(), NO_OPTIONS, reply_handler=reply_handler, error_handler=error_handler
+        )
+
+    def _rotate(self):
+        if self._switching:
+            return True  # 上一次轮换尚未完成
+        self._switching = True
+        index = (self.index + 1) % len(self.advertisements)
+        self._register(
+            self.advertisements[index],
+            lambda: self._switched(index),
+            self._switch_failed,
+        )
+        return True
+
+    def _switched(self, index):
+        previous = self.active
+        self.index = index
+        self.active.registered = True
+        previous.registered = False
+        self.adv_manager.UnregisterAdvertisement(
+            previous.get_path(),
+            reply_handler=self._unregistered,
+            error_handler=self._switch_failed,
+        )
+
+    def _unregistered(self):
+        self._switching = False
+        self.rotations += 1
+
+    def _switch_failed(self, error):
+        self._switching = False
+        logger.warning("⚠️ 广播轮换失败: %s", error)
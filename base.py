@@ -1,7 +1,13 @@
+import logging
+
 import dbus
 import dbus.exceptions
 import dbus.service
 
+import metrics
+
+logger = logging.getLogger(__name__)
+
 BLUEZ_SERVICE_NAME = "org.bluez"
 GATT_SERVICE_IFACE = "org.bluez.GattService1"
 GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
@@ -10,29 +16,165 @@ LE_ADVERTISEMENT_IFACE = "org.bluez.LEAdvertisement1"
 
 DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
 DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+METRICS_IFACE = "org.bluez.example.Metrics"
+
+DEFAULT_BASE_PATH = "/org/bluez/example"
+
+
+def _byte_array(value):
+    return dbus.Array(value, signature="y")
+
+
+def _string_array(value):
+    return dbus.Array(value, signature="s")
+
+
+def _path_array(objects):
+    return dbus.Array([obj.get_path() for obj in objects], signature="o")
+
+
+class Property:
+    """声明式 D-Bus 属性，作为类属性使用
+
+    赋值时只让本属性的编码结果失效；Get/GetAll 返回缓存的、可直接 marshal 的值。
+    getter 用于派生属性（如子对象路径列表），内容变化时调用 property_changed()。
+    编码结果为 None 的属性不出现在 GetAll 中。
+    """
+
+    __slots__ = ("name", "encode", "getter", "attr")
+
+    def __init__(self, name, encode, getter=None):
+        self.name = name
+        self.encode = encode
+        self.getter = getter
+        self.attr = None
+
+    def __set_name__(self, owner, attr):
+        self.attr = attr
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        if self.getter is not None:
+            return self.getter(obj)
+        try:
+            return obj.__dict__[self.attr]
+        except KeyError:
+            raise AttributeError(self.attr) from None
+
+    def __set__(self, obj, value):
+        if self.getter is not None:
+            raise AttributeError(f"{self.attr} 是只读的派生属性")
+        obj.__dict__[self.attr] = value
+        obj.property_changed(self.name)
 
+    def marshal(self, obj):
+        value = self.__get__(obj)
+        return None if value is None else self.encode(value)
+
+
+class DBusObject(metrics.InstrumentedObject, dbus.service.Object):
+    INTERFACE = None
+    _schema = {}  # D-Bus 属性名 -> Property，由 __init_subclass__ 按类收集
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        schema = {}
+        for klass in reversed(cls.__mro__):
+            for attr in vars(klass).values():
+                if isinstance(attr, Property):
+                    schema[attr.name] = attr
+        cls._schema = schema
 
-class DBusObject(dbus.service.Object):
     def __init__(self, bus, path):
         super().__init__(bus, path)
         self.path = path
+        self._encoded = {}  # 属性名 -> 编码后的值
+        self._all = None  # 缓存的 GetAll 结果
+
+    def property_changed(self, *names):
+        """属性变化：丢弃这些属性的编码结果，并让 Application 重建本对象的条目"""
+        encoded = self.__dict__.get("_encoded")
+        if encoded is None:
+            return  # 尚未初始化完成，GetAll 时会重新编码
+        for name in names:
+            encoded.pop(name, None)
+        self._all = None
+        self.invalidate()
+
+    def _property(self, name):
+        encoded = self._encoded
+        try:
+            return encoded[name]
+        except KeyError:
+            value = encoded[name] = self._schema[name].marshal(self)
+            return value
+
+    def get_properties(self):
+        props = self._all
+        if props is None:
+            props = {}
+            for name in self._schema:
+                value = self._property(name)
+                if value is not None:
+                    props[name] = value
+            self._all = props
+        return props
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="ss", out_signature="v")
+    def Get(self, interface, prop):
+        if interface != self.INTERFACE or prop not in self._schema:
+            raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
+        value = self._property(prop)
+        if value is None:
+            raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
+        return value
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
+    def GetAll(self, interface):
+        if interface != self.INTERFACE:
+            raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
+        return self.get_properties()
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    def get_application(self):
+        return None
+
+    def invalidate(self):
+        """属性变化后通知所属 Application 重新生成本对象的缓存条目"""
+        app = self.get_application()
+        if app is not None:
+            app.invalidate(self)
+
 
 class GattService(DBusObject):
+    INTERFACE = GATT_SERVICE_IFACE
 
-    def __init__(self, bus, index, uuid, primary):
-        self.path = f"/org/bluez/example/service{index}"
+    uuid = Property("UUID", dbus.String)
+    primary = Property("Primary", dbus.Boolean)
+    characteristic_paths = Property(
+        "Characteristics", _path_array, getter=lambda self: self.characteristics
+    )
+
+    def __init__(self, bus, index, uuid, primary, base_path=DEFAULT_BASE_PATH):
+        self.path = f"{base_path}/service{index}"
         self.bus = bus
         self.uuid = uuid
         self.primary = primary
         self.characteristics = []
+        self.application = None
         super().__init__(self.bus, self.path)
 
+    def get_application(self):
+        return self.application
+
     def add_characteristic(self, characteristic):
         self.characteristics.append(characteristic)
+        self.property_changed("Characteristics")
+        if self.application is not None:
+            self.application.invalidate_tree(characteristic)
 
     def get_characteristic_paths(self):
         result = []
@@ -40,25 +182,6 @@ class GattService(DBusObject):
             result.append(chrc.get_path())
         return result
 
-    @dbus.service.method(
-        dbus_interface="org.freedesktop.DBus.Properties",
-        in_signature="s",
-        out_signature="a{sv}",
-    )
-    def GetAll(self, interface):
-        if interface != GATT_SERVICE_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        return {
-            "UUID": self.uuid,
-            "Primary": self.primary,
-            "Characteristics": dbus.Array(
-                [c.get_path() for c in self.characteristics], signature="o"
-            ),
-        }
-
     # @dbus.service.method(
     #     "org.freedesktop.DBus.Introspectable", in_signature="", out_signature="s"
     # )
@@ -68,6 +191,18 @@ class GattService(DBusObject):
 
 
 class GattCharacteristic(DBusObject):
+    INTERFACE = GATT_CHRC_IFACE
+
+    service_path = Property(
+        "Service", dbus.ObjectPath, getter=lambda self: self.service.get_path()
+    )
+    uuid = Property("UUID", dbus.String)
+    flags = Property("Flags", _string_array)
+    descriptor_paths = Property(
+        "Descriptors", _path_array, getter=lambda self: self.descriptors
+    )
+    value = Property("Value", _byte_array)
+
     def __init__(self, bus, index, uuid, flags, service):
         self.path = f"{service.get_path()}/char{index}"
         self.bus = bus
@@ -76,11 +211,32 @@ class GattCharacteristic(DBusObject):
         self.service = service
         self.descriptors = []
         self.value = []
-        self.notifying = False
+        self._notifying = False
         super().__init__(self.bus, self.path)
 
+    @property
+    def notifying(self):
+        return self._notifying
+
+    @notifying.setter
+    def notifying(self, notifying):
+        notifying = bool(notifying)
+        if notifying != self._notifying:
+            self._notifying = notifying
+            self.notify_changed(notifying)
+
+    def notify_changed(self, notifying):
+        """订阅状态变化的钩子，子类覆盖"""
+        pass
+
+    def get_application(self):
+        return self.service.get_application()
+
     def add_descriptor(self, descriptor):
         self.descriptors.append(descriptor)
+        self.property_changed("Descriptors")
+        if self.get_application() is not None:
+            descriptor.invalidate()
 
     def get_descriptor_paths(self):
         result = []
@@ -88,66 +244,25 @@ class GattCharacteristic(DBusObject):
             result.append(desc.get_path())
         return result
 
-    @dbus.service.method(
-        "org.freedesktop.DBus.Properties", in_signature="ss", out_signature="v"
-    )
-    def Get(self, interface, prop):
-        if interface != GATT_CHRC_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        if prop == "UUID":
-            return self.uuid
-        elif prop == "Service":
-            return self.service.get_path()
-        elif prop == "Flags":
-            return dbus.Array(self.flags, signature="s")
-        elif prop == "Descriptors":
-            return dbus.Array([d.get_path() for d in self.descriptors], signature="o")
-
-        raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
-
-    @dbus.service.method(
-        "org.freedesktop.DBus.Properties", in_signature="s", out_signature="a{sv}"
-    )
-    def GetAll(self, interface):
-        if interface != GATT_CHRC_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        result = {
-            "Service": self.service.get_path(),
-            "UUID": self.uuid,
-            "Flags": self.flags,
-            "Descriptors": dbus.Array(
-                [d.get_path() for d in self.descriptors], signature="o"
-            ),
-        }
-        if hasattr(self, "value"):
-            result["Value"] = dbus.Array(self.value, signature="y")
-        return result
-
     @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        print("Default ReadValue called, returning error")
+        logger.debug("Default ReadValue called, returning error")
         raise NotSupportedException()
 
     @dbus.service.method(GATT_CHRC_IFACE, in_signature="aya{sv}")
     def WriteValue(self, value, options):
-        print("Default WriteValue called, returning error")
+        logger.debug("Default WriteValue called, returning error")
         raise NotSupportedException()
 
     @dbus.service.method(GATT_CHRC_IFACE)
     def StartNotify(self):
         self.notifying = True
-        print("🔔 StartNotify 被调用")
+        logger.info("🔔 StartNotify 被调用: %s", self.uuid)
 
     @dbus.service.method(GATT_CHRC_IFACE)
     def StopNotify(self):
         self.notifying = False
-        print("🔕 StopNotify 被调用")
+        logger.info("🔕 StopNotify 被调用: %s", self.uuid)
 
     @dbus.service.signal(GATT_CHRC_IFACE, signature="sa{sv}as")
     def PropertiesChanged(self, interface, changed, invalidated):
@@ -159,6 +274,17 @@ class GattCharacteristic(DBusObject):
 
 
 class GattDescriptor(DBusObject):
+    INTERFACE = GATT_DESC_IFACE
+
+    uuid = Property("UUID", dbus.String)
+    characteristic_path = Property(
+        "Characteristic",
+        dbus.ObjectPath,
+        getter=lambda self: self.characteristic.get_path(),
+    )
+    flags = Property("Flags", _string_array)
+    value = Property("Value", _byte_array)
+
     def __init__(self, bus, index, uuid, flags, characteristic, value=None):
         self.path = f"{characteristic.get_path()}/desc{index}"
         self.bus = bus
@@ -168,68 +294,87 @@ class GattDescriptor(DBusObject):
         self.value = value or []
         super().__init__(self.bus, self.path)
 
-    @dbus.service.method(
-        "org.freedesktop.DBus.Properties", in_signature="s", out_signature="a{sv}"
-    )
-    def GetAll(self, interface):
-        if interface != GATT_DESC_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        return {
-            "UUID": self.uuid,
-            "Characteristic": self.characteristic.get_path(),
-            "Flags": dbus.Array(self.flags, signature="s"),
-            "Value": dbus.Array(self.value, signature="y"),
-        }
+    def get_application(self):
+        return self.characteristic.get_application()
 
     @dbus.service.method(GATT_DESC_IFACE, in_signature="a{sv}", out_signature="ay")
     def ReadValue(self, options):
-        print(f"📘 Read Descriptor {self.uuid}")
+        logger.debug("📘 Read Descriptor %s", self.uuid)
         return dbus.Array(self.value, signature="y")
 
     @dbus.service.method(GATT_DESC_IFACE, in_signature="aya{sv}")
     def WriteValue(self, value, options):
-        print(f"📝 Write Descriptor {self.uuid}, value: {value}")
+        logger.debug("📝 Write Descriptor %s, value: %s", self.uuid, value)
         self.value = value
 
 
-class Application(dbus.service.Object):
+class Application(metrics.InstrumentedObject, dbus.service.Object):
 
-    def __init__(self, bus):
+    def __init__(self, bus, base_path=DEFAULT_BASE_PATH):
         self.bus = bus
-        self.path = "/org/bluez/example/app"
+        self.path = f"{base_path}/app"
         self.services = []
+        # GetManagedObjects 的缓存结果，只重建 _stale 中的条目
+        self._managed_objects = {}
+        self._stale = {}
         super().__init__(self.bus, self.path)
 
     def add_service(self, service):
         self.services.append(service)
+        service.application = self
+        self.invalidate_tree(service)
+
+    def invalidate(self, obj):
+        self._stale[obj.path] = obj
+
+    def invalidate_tree(self, obj):
+        """标记对象及其全部子对象需要重建"""
+        self._stale[obj.path] = obj
+        for chrc in getattr(obj, "characteristics", ()):
+            self.invalidate_tree(chrc)
+        for desc in getattr(obj, "descriptors", ()):
+            self._stale[desc.path] = desc
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     @dbus.service.method(DBUS_OM_IFACE, out_signature="a{oa{sa{sv}}}")
     def GetManagedObjects(self):
-        response = {}
-        for service in self.services:
-            response[service.get_path()] = {
-                GATT_SERVICE_IFACE: service.GetAll(GATT_SERVICE_IFACE)
-            }
-            for ch in service.characteristics:
-                response[ch.get_path()] = {GATT_CHRC_IFACE: ch.GetAll(GATT_CHRC_IFACE)}
-
-                for desc in ch.descriptors:
-                    response[desc.get_path()] = {
-                        GATT_DESC_IFACE: desc.GetAll(GATT_DESC_IFACE)
-                    }
-
+        response = self._managed_objects
+        if self._stale:
+            stale, self._stale = self._stale, {}
+            for obj in stale.values():
+                response[obj.get_path()] = {obj.INTERFACE: obj.get_properties()}
         return response
 
+    @dbus.service.method(METRICS_IFACE, out_signature="s")
+    def GetStats(self):
+        """返回调用计数与延迟直方图的文本"""
+        return metrics.dump()
+
 
 class Advertisement(DBusObject):
-    def __init__(self, bus, index, advertising_type):
-        self.path = f"/org/bluez/example/advertisement{index}"
+    """LE 广播；注册后修改字段会发出 PropertiesChanged，BlueZ 直接刷新广播数据"""
+
+    INTERFACE = LE_ADVERTISEMENT_IFACE
+    registered = False  # 由注册方在 RegisterAdvertisement 成功后置位
+    _batch = None  # update() 期间收集变化的属性名
+
+    ad_type = Property("Type", dbus.String)
+    service_uuids = Property("ServiceUUIDs", _string_array)
+    solicit_uuids = Property("SolicitUUIDs", _string_array)
+    manufacturer_data = Property(
+        "ManufacturerData", lambda data: dbus.Dictionary(data, signature="qv")
+    )
+    service_data = Property(
+        "ServiceData", lambda data: dbus.Dictionary(data, signature="sv")
+    )
+    local_name = Property("LocalName", dbus.String)
+    include_tx_power = Property("IncludeTxPower", dbus.Boolean)
+    appearance = Property("Appearance", dbus.UInt16)
+
+    def __init__(self, bus, index, advertising_type, base_path=DEFAULT_BASE_PATH):
+        self.path = f"{base_path}/advertisement{index}"
         self.bus = bus
         self.ad_type = advertising_type
         self.service_uuids = []
@@ -243,60 +388,71 @@ class Advertisement(DBusObject):
 
     def add_service_uuid(self, uuid):
         self.service_uuids.append(uuid)
+        self.property_changed("ServiceUUIDs")
 
     def set_local_name(self, name):
         self.local_name = name
 
-    @dbus.service.method(
-        "org.freedesktop.DBus.Properties", in_signature="ss", out_signature="v"
-    )
-    def Get(self, interface, prop):
-        if interface != LE_ADVERTISEMENT_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        if prop == "Type":
-            return self.ad_type
-        elif prop == "ServiceUUIDs":
-            return dbus.Array(self.service_uuids, signature="s")
-        elif prop == "SolicitUUIDs":
-            return dbus.Array(self.solicit_uuids, signature="s")
-        elif prop == "ManufacturerData":
-            return self.manufacturer_data
-        elif prop == "ServiceData":
-            return self.service_data
-        elif prop == "LocalName":
-            return self.local_name
-        elif prop == "IncludeTxPower":
-            return self.include_tx_power
-        elif prop == "Appearance":
-            return dbus.UInt16(self.appearance)
-
-        raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
-
-    @dbus.service.method(
-        "org.freedesktop.DBus.Properties", in_signature="s", out_signature="a{sv}"
-    )
-    def GetAll(self, interface):
-        if interface != LE_ADVERTISEMENT_IFACE:
-            raise dbus.exceptions.DBusException(
-                "org.freedesktop.DBus.Error.InvalidArgs"
-            )
-
-        props = {
-            "Type": self.ad_type,
-            "ServiceUUIDs": dbus.Array(self.service_uuids, signature="s"),
-            "SolicitUUIDs": dbus.Array(self.solicit_uuids, signature="s"),
-            "ManufacturerData": dbus.Dictionary(self.manufacturer_data, signature="qv"),
-            "ServiceData": dbus.Dictionary(self.service_data, signature="sv"),
-            "LocalName": self.local_name,
-            "IncludeTxPower": self.include_tx_power,
-            "Appearance": dbus.UInt16(self.appearance),
-        }
-
-        return props
+    def set_manufacturer_data(self, company_id, data):
+        """设置（data 为 None 时删除）某个厂商的数据"""
+        manufacturer_data = dict(self.manufacturer_data)
+        if data is None:
+            manufacturer_data.pop(company_id, None)
+        else:
+            manufacturer_data[company_id] = _byte_array(data)
+        self.manufacturer_data = manufacturer_data
+
+    def set_service_data(self, uuid, data):
+        """设置（data 为 None 时删除）某个服务的数据"""
+        service_data = dict(self.service_data)
+        if data is None:
+            service_data.pop(uuid, None)
+        else:
+            service_data[uuid] = _byte_array(data)
+        self.service_data = service_data
+
+    def update(self, **fields):
+        """一次修改多个字段，只发出一个 PropertiesChanged"""
+        for attr in fields:
+            if not isinstance(getattr(type(self), attr, None), Property):
+                raise AttributeError(f"未知的广播字段: {attr}")
+        self._batch = names = set()
+        try:
+            for attr, value in fields.items():
+                setattr(self, attr, value)
+        finally:
+            self._batch = None
+        if names and self.registered:
+            self._emit_changed(names)
+
+    def property_changed(self, *names):
+        super().property_changed(*names)
+        if self._batch is not None:
+            self._batch.update(names)
+        elif self.registered:
+            self._emit_changed(names)
+
+    def _emit_changed(self, names):
+        changed = {}
+        invalidated = []
+        for name in names:
+            value = self._property(name)
+            if value is None:
+                invalidated.append(name)
+            else:
+                changed[name] = value
+        self.PropertiesChanged(
+            LE_ADVERTISEMENT_IFACE,
+            dbus.Dictionary(changed, signature="sv"),
+            dbus.Array(invalidated, signature="s"),
+        )
+        logger.info("📡 广播已更新: %s", ", ".join(sorted(names)))
+
+    @dbus.service.signal(DBUS_PROP_IFACE, signature="sa{sv}as")
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
 
     @dbus.service.method(LE_ADVERTISEMENT_IFACE, in_signature="", out_signature="")
     def Release(self):
-        print("📡 广播已释放")
+        self.registered = False
+        logger.info("📡 广播已释放")
@@ -0,0 +1,197 @@
+# benchmark.py
+"""在私有 dbus-daemon + 模拟 BlueZ 上测量注册耗时、GetManagedObjects 延迟、报文吞吐和端到端延迟"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+from gi.repository import GLib
+
+import metrics
+from main import BLUEZ_SERVICE_NAME, create_keyboard
+from mock_bluez import BENCH_IFACE
+from report import KEY_DOWN, KEY_RELEASE
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_PATH = "/org/bluez/hci0"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_dbus_daemon():
+    """启动私有 dbus-daemon，返回 (进程, 地址)"""
+    proc = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    address = proc.stdout.readline().strip()
+    if not address:
+        proc.kill()
+        raise RuntimeError("dbus-daemon 启动失败")
+    return proc, address
+
+
+def start_mock_bluez(address, notify_mode):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(HERE, "mock_bluez.py"),
+            "--address",
+            address,
+            "--adapter",
+            ADAPTER_PATH,
+            "--notify-mode",
+            notify_mode,
+        ]
+    )
+
+
+def wait_until(predicate, timeout=10.0, step_ms=5):
+    """运行主循环直到 predicate() 为真"""
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("等待超时")
+        if not context.iteration(False):
+            time.sleep(step_ms / 1000)
+
+
+def call_async(method, *args, timeout=30.0):
+    """发起异步 D-Bus 调用并驱动主循环等待结果，避免与本进程导出的对象死锁"""
+    result = {}
+    method(
+        *args,
+        reply_handler=lambda *r: result.setdefault("reply", r),
+        error_handler=lambda e: result.setdefault("error", e),
+        timeout=timeout,
+    )
+    wait_until(lambda: result, timeout=timeout)
+    if "error" in result:
+        raise result["error"]
+    reply = result["reply"]
+    return reply[0] if len(reply) == 1 else None
+
+
+def percentiles(samples_ns):
+    if not samples_ns:
+        return {"count": 0}
+    ordered = sorted(samples_ns)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    return {
+        "count": len(ordered),
+        "mean_us": sum(ordered) / len(ordered) / 1000,
+        "p50_us": pick(50) / 1000,
+        "p99_us": pick(99) / 1000,
+        "max_us": ordered[-1] / 1000,
+    }
+
+
+def run(args):
+    results = {"notify_mode": args.notify_mode}
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(args.address)
+    wait_until(lambda: bus.name_has_owner(BLUEZ_SERVICE_NAME))
+
+    adapter = bus.get_object(BLUEZ_SERVICE_NAME, ADAPTER_PATH)
+    gatt_manager = dbus.Interface(adapter, "org.bluez.GattManager1")
+    adv_manager = dbus.Interface(adapter, "org.bluez.LEAdvertisingManager1")
+    bench = dbus.Interface(adapter, BENCH_IFACE)
+
+    # 注册耗时：从创建对象到 BlueZ 应答 RegisterApplication / RegisterAdvertisement
+    start = time.monotonic_ns()
+    app, hid_service, advs = create_keyboard(bus)
+    results["build_ms"] = (time.monotonic_ns() - start) / 1e6
+    call_async(gatt_manager.RegisterApplication, app.get_path(), {})
+    results["register_application_ms"] = (time.monotonic_ns() - start) / 1e6
+    adv_start = time.monotonic_ns()
+    call_async(adv_manager.RegisterAdvertisement, advs[0].get_path(), {})
+    results["register_advertisement_ms"] = (time.monotonic_ns() - adv_start) / 1e6
+
+    samples = call_async(bench.TimeGetManagedObjects, app.get_path(), args.gmo_calls)
+    results["get_managed_objects"] = percentiles([int(s) for s in samples])
+
+    wait_until(lambda: call_async(bench.IsSubscribed))
+    char = hid_service.inputReport
+    reports = [KEY_DOWN[0x04 + i % 26] if i % 2 == 0 else KEY_RELEASE for i in range(args.reports)]
+
+    # 持续吞吐：直接调用 send_key_report，直到 central 收齐全部报文
+    call_async(bench.TakeReceived)
+    start = time.monotonic_ns()
+    for report in reports:
+        char.send_key_report(report)
+    send_done = time.monotonic_ns()
+    wait_until(lambda: call_async(bench.ReceivedCount) >= len(reports), timeout=60)
+    received = call_async(bench.TakeReceived)
+    elapsed = int(received[-1]) - start
+    results["throughput"] = {
+        "reports": len(reports),
+        "send_reports_per_sec": len(reports) / ((send_done - start) / 1e9),
+        "delivered_reports_per_sec": len(reports) / (elapsed / 1e9),
+    }
+
+    # 端到端延迟：按固定间隔逐个发送，对比发送与接收时间
+    sent = []
+    pending = iter(reports[: args.latency_reports])
+
+    def send_next():
+        report = next(pending, None)
+        if report is None:
+            return False
+        sent.append(time.monotonic_ns())
+        char.send_key_report(report)
+        return True
+
+    GLib.timeout_add(args.latency_interval_ms, send_next)
+    wait_until(
+        lambda: len(sent) >= args.latency_reports
+        and call_async(bench.ReceivedCount) >= len(sent),
+        timeout=60 + args.latency_reports * args.latency_interval_ms / 1000,
+    )
+    received = call_async(bench.TakeReceived)
+    results["end_to_end"] = percentiles([int(r) - s for s, r in zip(sent, received)])
+    results["metrics"] = metrics.snapshot()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notify-mode", choices=("acquire", "signal"), default="acquire")
+    parser.add_argument("--reports", type=int, default=20000, help="吞吐测试的报文数")
+    parser.add_argument("--latency-reports", type=int, default=1000)
+    parser.add_argument("--latency-interval-ms", type=int, default=2)
+    parser.add_argument("--gmo-calls", type=int, default=200)
+    parser.add_argument("--output", help="结果 JSON 文件，默认输出到 stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("BLE_KEYBOARD_LOG_LEVEL", "WARNING").upper())
+    daemon, args.address = start_dbus_daemon()
+    mock = start_mock_bluez(args.address, args.notify_mode)
+    try:
+        results = run(args)
+    finally:
+        mock.terminate()
+        daemon.terminate()
+        mock.wait()
+        daemon.wait()
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,43 @@
 # characteristic.py
+import logging
+import socket
+
 import dbus
-from base import GattCharacteristic, GattDescriptor
+import dbus.exceptions
+import dbus.service
+from gi.repository import GLib
+
+from base import GattCharacteristic, GattDescriptor, Property
+from keymap import get_keymap
+from keystate import KeyState
+from macro import MacroPlayer
+from report import (
+    CONSUMER_REPORT_POOL,
+    MOUSE_REPORT_POOL,
+    NO_INVALIDATED,
+    REPORT_POOL,
+    REPORT_POOLS,
+)
+from report_maps import (
+    COMPOSITE_REPORT_MAPS,
+    REPORT_ID_CONSUMER,
+    REPORT_ID_KEYBOARD,
+    REPORT_ID_MOUSE,
+    REPORT_MAPS,
+)
+from scheduler import OVERFLOW_BLOCK, ReportScheduler
+
+logger = logging.getLogger(__name__)
 
 GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
 
+DEFAULT_ATT_MTU = 23
+
+PROTOCOL_MODE_BOOT = 0x00
+PROTOCOL_MODE_REPORT = 0x01
+
+REPORT_TYPE_INPUT = 0x01
+
 # HID Information characteristic
 class HIDInformationCharacteristic(GattCharacteristic):
     CHARACTERISTIC_UUID = '2A4A'
@@ -16,54 +50,24 @@ class HIDInformationCharacteristic(GattCharacteristic):
         self.value = [0x01, 0x01, 0x00, 0x03]  # HID v1.1, CountryCode=0, Flags=3
 
     def ReadValue(self, options):
-        print(f'Read HIDInformation: {self.value}')
+        logger.debug('Read HIDInformation: %s', self.value)
         return self.value
 
 # HID Report Map characteristic
 class ReportMapCharacteristic(GattCharacteristic):
     CHARACTERISTIC_UUID = '2A4B'
-    def __init__(self, bus, index, service):
+    def __init__(self, bus, index, service, report_mode='6kro', composite=False):
         GattCharacteristic.__init__(
             self, bus, index,
             self.CHARACTERISTIC_UUID,
             ['read'],
             service)
-        self.value = [
-            0x05, 0x01,       # Usage Page (Generic Desktop)
-            0x09, 0x06,       # Usage (Keyboard)
-            0xA1, 0x01,       # Collection (Application)
-            0x05, 0x07,       #   Usage Page (Key Codes)
-            0x19, 0xE0,       #   Usage Minimum (224)
-            0x29, 0xE7,       #   Usage Maximum (231)
-            0x15, 0x00,       #   Logical Minimum (0)
-            0x25, 0x01,       #   Logical Maximum (1)
-            0x75, 0x01,       #   Report Size (1)
-            0x95, 0x08,       #   Report Count (8)
-            0x81, 0x02,       #   Input (Data, Variable, Absolute)
-            0x95, 0x01,       #   Report Count (1)
-            0x75, 0x08,       #   Report Size (8)
-            0x81, 0x03,       #   Input (Constant, Variable)
-            0x95, 0x05,       #   Report Count (5)
-            0x75, 0x01,       #   Report Size (1)
-            0x05, 0x08,       #   Usage Page (LEDs)
-            0x19, 0x01,       #   Usage Minimum (Num Lock)
-            0x29, 0x05,       #   Usage Maximum (Kana)
-            0x91, 0x02,       #   Output (Data, Variable, Absolute)
-            0x95, 0x01,       #   Report Count (1)
-            0x75, 0x03,       #   Report Size (3)
-            0x91, 0x03,       #   Output (Constant)
-            0x95, 0x06,       #   Report Count (6)
-            0x75, 0x08,       #   Report Size (8)
-            0x15, 0x00,       #   Logical Minimum (0)
-            0x25, 0x65,       #   Logical Maximum (101)
-            0x05, 0x07,       #   Usage Page (Key codes)
-            0x19, 0x00,       #   Usage Minimum (0)
-            0x29, 0x65,       #   Usage Maximum (101)
-            0x81, 0x00,       #   Input (Data, Array)
-            0xC0              # End Collection
-        ]
+        # composite: 键盘 + 多媒体键 + 鼠标，各带 Report ID
+        report_maps = COMPOSITE_REPORT_MAPS if composite else REPORT_MAPS
+        self.value = list(report_maps[report_mode])
+
     def ReadValue(self, options):
-        print(f'Read ReportMap: {self.value}')
+        logger.debug('Read ReportMap: %s', self.value)
         return self.value
 
 
@@ -79,35 +83,319 @@ class ControlPointCharacteristic(GattCharacteristic):
         self.value = dbus.Array(bytearray.fromhex('00'), signature=dbus.Signature('y'))
 
     def WriteValue(self, value, options):
-        print(f'Write ControlPoint {value}')
+        logger.debug('Write ControlPoint %s', value)
         self.value = value
 
-# Input Report characteristic
-class InputReportCharacteristic(GattCharacteristic):
-    CHARACTERISTIC_UUID = '2A4D'
-    def __init__(self, bus, index, service):
+class NotifySubscriber:
+    """一个 central 的订阅：AcquireNotify 得到的 socket，sock 为 None 时经信号通知"""
+    __slots__ = ("device", "sock", "mtu", "watch")
+
+    def __init__(self, device, sock=None, mtu=DEFAULT_ATT_MTU, watch=None):
+        self.device = device
+        self.sock = sock
+        self.mtu = mtu
+        self.watch = watch
+
+
+class ClientConfigurationDescriptor(GattDescriptor):
+    """2902 CCCD：按 options['device'] 分别保存每个 central 的配置"""
+    def __init__(self, bus, index, characteristic):
+        GattDescriptor.__init__(
+            self, bus, index, '2902', ['read', 'write'], characteristic, [0x00, 0x00])
+        self.device_values = {}
+
+    def ReadValue(self, options):
+        return dbus.Array(
+            self.device_values.get(options.get('device'), self.value), signature='y')
+
+    def WriteValue(self, value, options):
+        device = options.get('device')
+        logger.debug('📝 Write CCCD %s, device: %s, value: %s', self.uuid, device, value)
+        self.device_values[device] = list(value)
+        if value and value[0] & 0x01:
+            self.characteristic.subscribe(device)
+        else:
+            self.characteristic.unsubscribe(device)
+
+
+class ReportCharacteristic(GattCharacteristic):
+    """可通知的报文特征值：按 central 记录订阅，AcquireNotify 的走 fd，其余走 PropertiesChanged 信号"""
+    REPORT_ID = 0  # Boot 报文没有 Report ID
+    notify_acquired = Property(
+        "NotifyAcquired", dbus.Boolean,
+        getter=lambda self: any(sub.sock is not None for sub in self.subscribers.values()))
+    def __init__(self, bus, index, uuid, service, report_pool):
         GattCharacteristic.__init__(
             self, bus, index,
-            self.CHARACTERISTIC_UUID,
+            uuid,
             ['read', 'notify'],
             service)
-        self.value = [0x00] * 8
+        self.report_pool = report_pool
+        self.value = self.report_pool.release
+        # 已订阅的 central：device 路径 -> NotifySubscriber；StartNotify 不带 device，记为 None
+        self.subscribers = {}
+        # 每个实际发出的报文都会调用 hook(self, report)，用于录制等
+        self.report_hooks = []
 
         # 2902 - Client Characteristic Configuration Descriptor (CCCD)
-        self.add_descriptor(GattDescriptor(bus, 0, '2902', ['read', 'write'], self, [0x00, 0x00]))
+        self.add_descriptor(ClientConfigurationDescriptor(bus, 0, self))
 
-        # 2908 - Report Reference Descriptor: [Report ID, Report Type]
-        self.add_descriptor(GattDescriptor(bus, 1, '2908', ['read'], self, [0x01, 0x01]))
+    def StartNotify(self):
+        logger.info("🔔 StartNotify 被调用: %s", self.uuid)
+        self.subscribe(None)
 
-    def send_key_report(self, report):
-        """发送按键报告（仅在通知启用时）"""
-        print(f"⌨️ 发送 HID 报文: {report}")
-        self.value = report
-        self.PropertiesChanged(
-            'org.bluez.GattCharacteristic1',
-            {'Value': dbus.Array(report, signature='y')},
-            []
+    def StopNotify(self):
+        """BlueZ 在最后一个经信号通知的 central 取消订阅时调用"""
+        logger.info("🔕 StopNotify 被调用: %s", self.uuid)
+        for device, sub in list(self.subscribers.items()):
+            if sub.sock is None:
+                self.unsubscribe(device)
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="hq")
+    def AcquireNotify(self, options):
+        """BlueZ 获取通知 fd：之后发给该 central 的报文直接写入 socket，不再经过 D-Bus 信号"""
+        device = options.get("device")
+        mtu = int(options.get("mtu", DEFAULT_ATT_MTU))
+        local, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        local.setblocking(False)
+        watch = GLib.io_add_watch(
+            local.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_HUP | GLib.IO_ERR,
+            self._on_notify_hup, device
         )
+        self.subscribe(device, NotifySubscriber(device, local, mtu, watch))
+        logger.info("🔔 AcquireNotify 被调用: %s, device=%s, MTU=%d", self.uuid, device, mtu)
+
+        fd = dbus.types.UnixFd(remote)  # dbus 会复制一份 fd
+        remote.close()
+        return fd, dbus.UInt16(mtu)
+
+    def subscribe(self, device, subscriber=None):
+        """登记一个 central 的订阅；已有的同一 device 订阅会被替换"""
+        self._release(self.subscribers.pop(device, None))
+        self.subscribers[device] = subscriber or NotifySubscriber(device)
+        self._subscribers_changed()
+
+    def unsubscribe(self, device):
+        subscriber = self.subscribers.pop(device, None)
+        if subscriber is not None:
+            self._release(subscriber)
+            self._subscribers_changed()
+
+    def _release(self, subscriber):
+        if subscriber is None:
+            return
+        if subscriber.watch is not None:
+            GLib.source_remove(subscriber.watch)
+            subscriber.watch = None
+        if subscriber.sock is not None:
+            subscriber.sock.close()
+            subscriber.sock = None
+
+    def _subscribers_changed(self):
+        self.property_changed("NotifyAcquired")
+        self.notifying = bool(self.subscribers)
+
+    def _on_notify_hup(self, fd, condition, device):
+        # BlueZ 关闭了对端（该 central 取消订阅或断开连接）
+        logger.info("🔕 Notify socket 已关闭: %s, device=%s", self.uuid, device)
+        subscriber = self.subscribers.get(device)
+        if subscriber is not None and subscriber.sock is not None \
+                and subscriber.sock.fileno() == fd:
+            subscriber.watch = None
+            self.unsubscribe(device)
+        return False
+
+    def notify_changed(self, notifying):
+        self.service.report_notify_changed(self)
+
+    def send_key_report(self, report, device=None):
+        """发送按键报告给全部订阅者，或只发给 device
+
+        报文只编码一次，各 socket 共享同一个 bytes 对象；信号无法指定 central，
+        任一目标需要信号时只发一次 PropertiesChanged，由 BlueZ 转发给全部信号订阅者。
+        device 未订阅时丢弃报文并返回 False（不能广播给其他 central）。
+        """
+        if device is not None:
+            subscriber = self.subscribers.get(device)
+            if subscriber is None:
+                logger.debug("⚠️ %s 未订阅，丢弃报文", device)
+                return False
+            targets = (subscriber,)
+        else:
+            targets = self.subscribers.values()
+        logger.debug("⌨️ 发送 HID 报文: %s", report)
+        if not isinstance(report, bytes):
+            report = self.report_pool.intern(report)
+        self.value = report
+        if self.report_hooks:
+            for hook in self.report_hooks:
+                hook(self, report)
+
+        signal = not targets
+        failed = None
+        for subscriber in targets:
+            sock = subscriber.sock
+            if sock is None:
+                signal = True
+                continue
+            try:
+                sock.send(report)
+            except BlockingIOError:
+                signal = True  # socket 缓冲区已满，本条报文改走信号
+            except OSError as e:
+                logger.warning("⚠️ Notify socket 写入失败，回退到信号: %s", e)
+                signal = True
+                failed = failed or []
+                failed.append(subscriber.device)
+        if failed:
+            for failed_device in failed:
+                # 改为经信号通知该 central
+                self.subscribe(failed_device)
+
+        if signal:
+            self.PropertiesChanged(
+                GATT_CHRC_IFACE,
+                self.report_pool.changed_properties(report),
+                NO_INVALIDATED
+            )
+        return True
+
+# Input Report characteristic
+class InputReportCharacteristic(ReportCharacteristic):
+    CHARACTERISTIC_UUID = '2A4D'
+    REPORT_ID = REPORT_ID_KEYBOARD
+    def __init__(self, bus, index, service, report_mode='6kro', overflow=OVERFLOW_BLOCK,
+                 dispatcher=None):
+        # 6kro: 8 字节标准报文；nkro: 修饰键 + Usage 位图
+        ReportCharacteristic.__init__(
+            self, bus, index,
+            self.CHARACTERISTIC_UUID,
+            service,
+            REPORT_POOLS[report_mode])
+        self.report_mode = report_mode
+
+        # 2908 - Report Reference Descriptor: [Report ID, Report Type]
+        self.add_descriptor(GattDescriptor(
+            bus, 1, '2908', ['read'], self, [self.REPORT_ID, REPORT_TYPE_INPUT]))
+
+        # 按连接间隔节奏发送的报文队列；主机订阅前暂停，报文先缓存
+        self.scheduler = ReportScheduler(
+            self.send_key_report, overflow=overflow, paused=True,
+            release=self.report_pool.release)
+        if dispatcher is not None:
+            dispatcher.register(self.REPORT_ID, self.scheduler)
+        self.keymap = get_keymap(REPORT_MAPS[report_mode], self.report_pool)
+        # 按键事件入口：合并同一轮的按下/抬起
+        self.key_state = KeyState(self)
+        # 预编译宏的回放
+        self.macros = MacroPlayer(self)
+
+    def queue_report(self, report):
+        """将报文放入发送队列；队列已满时返回 False"""
+        return self.scheduler.submit(report)
+
+    def type_text(self, text, done=None):
+        """输入一段文本：按下/抬起报文流式送入发送队列，完成后调用 done"""
+        self.scheduler.feed(self.keymap.iter_reports(text), done)
+
+    def play_macro(self, steps, done=None):
+        """回放一个宏（步骤序列或已编译的宏），完成后调用 done"""
+        self.macros.play(steps, done)
+
+class ExtraInputReportCharacteristic(ReportCharacteristic):
+    """组合设备中键盘以外的输入报文：独立的特征值、Report Reference 和发送队列"""
+    CHARACTERISTIC_UUID = '2A4D'
+    REPORT_ID = None
+    def __init__(self, bus, index, service, report_pool, overflow=OVERFLOW_BLOCK,
+                 dispatcher=None):
+        ReportCharacteristic.__init__(
+            self, bus, index,
+            self.CHARACTERISTIC_UUID,
+            service,
+            report_pool)
+        self.add_descriptor(GattDescriptor(
+            bus, 1, '2908', ['read'], self, [self.REPORT_ID, REPORT_TYPE_INPUT]))
+        self.scheduler = ReportScheduler(
+            self.send_key_report, overflow=overflow, paused=True,
+            release=self.report_pool.release)
+        if dispatcher is not None:
+            dispatcher.register(self.REPORT_ID, self.scheduler)
+
+# Consumer Control (多媒体键) Input Report
+class ConsumerInputReportCharacteristic(ExtraInputReportCharacteristic):
+    REPORT_ID = REPORT_ID_CONSUMER
+    def __init__(self, bus, index, service, overflow=OVERFLOW_BLOCK, dispatcher=None):
+        ExtraInputReportCharacteristic.__init__(
+            self, bus, index, service, CONSUMER_REPORT_POOL, overflow, dispatcher)
+
+    def tap(self, usage):
+        """按下并抬起一个 Consumer Usage（如 0xE9 音量+）；两个报文整体放入或整体丢弃"""
+        pool = self.report_pool
+        return self.scheduler.submit_many((pool.encode(usage), pool.release))
+
+# Mouse Input Report
+class MouseInputReportCharacteristic(ExtraInputReportCharacteristic):
+    REPORT_ID = REPORT_ID_MOUSE
+    def __init__(self, bus, index, service, overflow=OVERFLOW_BLOCK, dispatcher=None):
+        ExtraInputReportCharacteristic.__init__(
+            self, bus, index, service, MOUSE_REPORT_POOL, overflow, dispatcher)
+        self.buttons = 0
+
+    def move(self, dx, dy, wheel=0):
+        """相对移动；超过单个报文范围的位移拆成多个报文
+
+        拆出的报文数超过队列上限时抛出 ValueError（等待也放不进）。
+        """
+        pool = self.report_pool
+        steps = pool.motion_steps(dx, dy, wheel)
+        if steps > self.scheduler.batch_limit():
+            raise ValueError(f"位移过大：需要 {steps} 个报文，超过队列上限")
+        return self.scheduler.submit_many(
+            pool.encode_motion(self.buttons, dx, dy, wheel))
+
+    def set_buttons(self, buttons):
+        self.buttons = buttons
+        return self.scheduler.submit(self.report_pool.encode(buttons))
+
+    def click(self, buttons=0x01):
+        pool = self.report_pool
+        return self.scheduler.submit_many(
+            (pool.encode(self.buttons | buttons), pool.encode(self.buttons)))
+
+# Boot Keyboard Input Report characteristic
+class BootKeyboardInputReportCharacteristic(ReportCharacteristic):
+    CHARACTERISTIC_UUID = '2A22'
+    def __init__(self, bus, index, service, source_pool=REPORT_POOL):
+        ReportCharacteristic.__init__(
+            self, bus, index,
+            self.CHARACTERISTIC_UUID,
+            service,
+            REPORT_POOL)
+        # 输入报文所用的报文池（6KRO 或 NKRO），用于转换成 Boot 布局
+        self.source_pool = source_pool
+
+    def send_boot_report(self, report):
+        """Boot 协议固定 8 字节布局，无 Report ID；NKRO 报文先转换"""
+        self.send_key_report(self.source_pool.to_boot(report))
+
+# Boot Keyboard Output Report characteristic (LED)
+class BootKeyboardOutputReportCharacteristic(GattCharacteristic):
+    CHARACTERISTIC_UUID = '2A32'
+    def __init__(self, bus, index, service):
+        GattCharacteristic.__init__(
+            self, bus, index,
+            self.CHARACTERISTIC_UUID,
+            ['read', 'write', 'write-without-response'],
+            service)
+        self.value = [0x00]
+
+    def ReadValue(self, options):
+        logger.debug('Read BootOutputReport: %s', self.value)
+        return self.value
+
+    def WriteValue(self, value, options):
+        logger.debug('Write BootOutputReport %s', value)
+        self.value = value
 
 # Protocol Mode characteristic (Report Mode)
 class ProtocolModeCharacteristic(GattCharacteristic):
@@ -118,13 +406,22 @@ class ProtocolModeCharacteristic(GattCharacteristic):
             self.CHARACTERISTIC_UUID,
             ['read', 'write-without-response'],
             service)
-        self.value = [0x01]  # Report Protocol Mode
+        self.value = [PROTOCOL_MODE_REPORT]
 
     def ReadValue(self, options):
-        print(f'Read ProtocolMode: {self.value}')
+        logger.debug('Read ProtocolMode: %s', self.value)
         return self.value
 
     def WriteValue(self, value, options):
-        print(f'Write ProtocolMode {value}')
+        logger.debug('Write ProtocolMode %s', value)
+        if len(value) != 1:
+            raise dbus.exceptions.DBusException(
+                'Invalid protocol mode length', name='org.bluez.Error.InvalidValueLength'
+            )
+        if value[0] not in (PROTOCOL_MODE_BOOT, PROTOCOL_MODE_REPORT):
+            raise dbus.exceptions.DBusException(
+                'Invalid protocol mode', name='org.bluez.Error.InvalidArguments'
+            )
         self.value = value
+        self.service.set_protocol_mode(value[0])
 
@@ -0,0 +1,198 @@
+# evdev_bridge.py
+"""evdev 输入桥：把 Linux 键盘（/dev/input/event*）的按键转发给 BLE 主机
+
+批量读取 struct input_event，按查找表把 Linux 键码转换为 HID Usage，
+每个 SYN_REPORT 帧合并为一个报文送入 InputReportCharacteristic。
+也可以传入任意 fd（如管道），便于测试和脚本回放。
+"""
+import errno
+import fcntl
+import logging
+import os
+import struct
+
+from gi.repository import GLib
+
+import metrics
+from keymap import key_usage_max
+from keystate import MODIFIER_MIN
+from report_maps import REPORT_MAPS
+
+logger = logging.getLogger(__name__)
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0
+SYN_DROPPED = 3
+KEY_CNT = 0x300
+
+# struct input_event { struct timeval time; __u16 type; __u16 code; __s32 value; }
+# 时间戳不需要，解包时直接跳过
+_TIMEVAL_SIZE = struct.calcsize("ll")
+EVENT_FORMAT = f"{_TIMEVAL_SIZE}xHHi"
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+_unpack_from = struct.Struct(EVENT_FORMAT).unpack_from
+READ_EVENTS = 256  # 每次最多读取的事件数
+
+EVIOCGRAB = 0x40044590  # _IOW('E', 0x90, int)
+EVIOCGKEY = (2 << 30) | ((KEY_CNT // 8) << 16) | (ord("E") << 8) | 0x18
+
+# HID Usage -> Linux 键码（键盘页，同内核 usbkbd 的 usb_kbd_keycode 表）
+_USAGE_TO_KEYCODE = (
+    0, 0, 0, 0, 30, 48, 46, 32, 18, 33, 34, 35, 23, 36, 37, 38,
+    50, 49, 24, 25, 16, 19, 31, 20, 22, 47, 17, 45, 21, 44, 2, 3,
+    4, 5, 6, 7, 8, 9, 10, 11, 28, 1, 14, 15, 57, 12, 13, 26,
+    27, 43, 43, 39, 40, 41, 51, 52, 53, 58, 59, 60, 61, 62, 63, 64,
+    65, 66, 67, 68, 87, 88, 99, 70, 119, 110, 102, 104, 111, 107, 109, 106,
+    105, 108, 103, 69, 98, 55, 74, 78, 96, 79, 80, 81, 75, 76, 77, 71,
+    72, 73, 82, 83, 86, 127, 116, 117, 183, 184, 185, 186, 187, 188, 189, 190,
+    191, 192, 193, 194, 134, 138, 130, 132, 128, 129, 131, 137, 133, 135, 136, 113,
+)
+_MODIFIER_KEYCODES = (29, 42, 56, 125, 97, 54, 100, 126)  # 0xE0-0xE7
+
+
+def keycode_table(report_mode="6kro"):
+    """Linux 键码 -> HID Usage 查找表（bytes，0 表示不转发）"""
+    # 普通按键 Usage 上限取自该模式的报文描述符
+    limit = key_usage_max(REPORT_MAPS[report_mode])
+    table = bytearray(KEY_CNT)
+    for usage, keycode in enumerate(_USAGE_TO_KEYCODE[:limit + 1]):
+        if keycode and not table[keycode]:  # 同一键码取第一个 Usage
+            table[keycode] = usage
+    for usage, keycode in enumerate(_MODIFIER_KEYCODES, MODIFIER_MIN):
+        table[keycode] = usage
+    return bytes(table)
+
+
+class EvdevBridge:
+    """在 GLib 主循环中读取 evdev 事件，经 char.key_state 合并后发送"""
+
+    def __init__(self, char, source, grab=False):
+        if isinstance(source, str):
+            self.fd = os.open(source, os.O_RDONLY | os.O_NONBLOCK)
+            self.owns_fd = True
+        else:
+            self.fd = source
+            self.owns_fd = False
+            os.set_blocking(self.fd, False)
+        self.name = source if isinstance(source, str) else f"fd {source}"
+        self.char = char
+        self.key_state = char.key_state
+        self.table = keycode_table(char.report_mode)
+        self.grabbed = False
+        self._partial = b""
+        self._backlog = None  # 发送队列已满时尚未处理的事件
+        self._dropping = False  # SYN_DROPPED 之后丢弃到下一个 SYN_REPORT
+        if grab:
+            # 独占设备：本机不再收到这些按键
+            fcntl.ioctl(self.fd, EVIOCGRAB, 1)
+            self.grabbed = True
+        self._watch = None
+        self._add_watch()
+        logger.info("⌨️ 已接入输入设备 %s", self.name)
+
+    def _add_watch(self):
+        self._watch = GLib.io_add_watch(
+            self.fd, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_readable
+        )
+
+    def _on_readable(self, fd, condition):
+        try:
+            data = os.read(self.fd, READ_EVENTS * EVENT_SIZE)
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            if e.errno != errno.ENODEV:
+                logger.error("❌ 读取输入设备 %s 失败: %s", self.name, e)
+            data = b""
+        if not data:
+            logger.info("🔌 输入设备 %s 已断开", self.name)
+            self._watch = None
+            self.key_state.release_all()
+            self.close()
+            return False
+
+        if self._partial:
+            data = self._partial + data
+        # 只处理到最后一个 SYN_REPORT：管道可能在帧中间断开，半帧留到下次，
+        # 否则空闲刷新会把半帧状态单独发出
+        end = len(data) - len(data) % EVENT_SIZE
+        while end and _unpack_from(data, end - EVENT_SIZE)[:2] != (EV_SYN, SYN_REPORT):
+            end -= EVENT_SIZE
+        if not end and len(data) >= READ_EVENTS * EVENT_SIZE:
+            end = len(data) - len(data) % EVENT_SIZE  # 不发 SYN 的输入源
+        self._partial = data[end:]
+        if not end:
+            return True
+        metrics.incr("evdev.events", end // EVENT_SIZE)
+        if self._process(memoryview(data)[:end]):
+            return True
+        # 发送队列已满：暂停读取，事件留在内核缓冲区
+        self._watch = None
+        return False
+
+    def _process(self, events):
+        """处理一批事件；发送队列已满时保存剩余事件并返回 False"""
+        table = self.table
+        key_state = self.key_state
+        for i, (etype, code, value) in enumerate(struct.iter_unpack(EVENT_FORMAT, events)):
+            if etype == EV_KEY:
+                # value: 0 抬起，1 按下，2 自动重复（由主机负责重复）
+                if self._dropping or value == 2 or code >= KEY_CNT:
+                    continue
+                usage = table[code]
+                if not usage:
+                    continue
+                if value:
+                    key_state.press(usage)
+                else:
+                    key_state.release(usage)
+            elif etype == EV_SYN:
+                if code == SYN_REPORT:
+                    if self._dropping:
+                        self._dropping = False
+                        self._resync()
+                    if not key_state.flush():
+                        self._backlog = bytes(events[(i + 1) * EVENT_SIZE:])
+                        self.char.scheduler.on_writable(self._on_writable)
+                        return False
+                elif code == SYN_DROPPED:
+                    # 内核缓冲区溢出，丢弃到下一帧后按设备当前状态重建
+                    metrics.incr("evdev.dropped")
+                    self._dropping = True
+        return True
+
+    def _resync(self):
+        key_state = self.key_state
+        key_state.release_all()
+        bits = bytearray(KEY_CNT // 8)
+        try:
+            fcntl.ioctl(self.fd, EVIOCGKEY, bits)
+        except OSError:
+            return  # 不是 evdev 设备（如管道）：只能全部抬起
+        table = self.table
+        for code in range(KEY_CNT):
+            if bits[code >> 3] & (1 << (code & 7)) and table[code]:
+                key_state.press(table[code])
+
+    def _on_writable(self):
+        backlog, self._backlog = self._backlog, None
+        if backlog and not self._process(memoryview(backlog)):
+            return
+        if self._watch is None and self.fd is not None:
+            self._add_watch()
+
+    def close(self):
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+        if self.fd is None:
+            return
+        if self.grabbed:
+            try:
+                fcntl.ioctl(self.fd, EVIOCGRAB, 0)
+            except OSError:
+                pass  # 设备已拔出
+        if self.owns_fd:
+            os.close(self.fd)
+        self.fd = None
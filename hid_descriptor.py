@@ -0,0 +1,412 @@
+# hid_descriptor.py
+"""HID 报告描述符：声明式生成字节、解析字段布局，并批量校验/解码报文"""
+import struct
+
+# 条目类型
+MAIN, GLOBAL, LOCAL = 0, 1, 2
+
+# Main 条目
+INPUT, OUTPUT, COLLECTION, FEATURE, END_COLLECTION = 0x8, 0x9, 0xA, 0xB, 0xC
+# Global 条目
+USAGE_PAGE, LOGICAL_MIN, LOGICAL_MAX = 0x0, 0x1, 0x2
+REPORT_SIZE, REPORT_ID, REPORT_COUNT = 0x7, 0x8, 0x9
+# Local 条目
+USAGE, USAGE_MIN, USAGE_MAX = 0x0, 0x1, 0x2
+
+# Input/Output/Feature 标志位
+DATA = 0x00
+CONSTANT = 0x01
+ARRAY = 0x00
+VARIABLE = 0x02
+ABSOLUTE = 0x00
+RELATIVE = 0x04
+
+# Collection 类型
+PHYSICAL, APPLICATION, LOGICAL = 0x00, 0x01, 0x02
+
+# Usage Page
+PAGE_GENERIC_DESKTOP = 0x01
+PAGE_KEYBOARD = 0x07
+PAGE_LED = 0x08
+PAGE_BUTTON = 0x09
+PAGE_CONSUMER = 0x0C
+
+_REPORT_KINDS = {INPUT: "input", OUTPUT: "output", FEATURE: "feature"}
+
+
+def _encode_item(tag, item_type, value=None, signed=False):
+    if value is None:
+        return bytes([(tag << 4) | (item_type << 2)])
+    for size, code in ((1, 1), (2, 2), (4, 3)):
+        bits = size * 8
+        lo, hi = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+        if lo <= value <= hi:
+            prefix = (tag << 4) | (item_type << 2) | code
+            return bytes([prefix]) + value.to_bytes(size, "little", signed=signed)
+    raise ValueError(f"条目数值超出范围: {value}")
+
+
+class Field:
+    """报文中的一个字段：count 个 size 位的元素，从 bit_offset 开始"""
+
+    __slots__ = (
+        "name", "kind", "report_id", "bit_offset", "size", "count", "flags",
+        "usage_page", "usages", "usage_min", "usage_max", "logical_min", "logical_max",
+    )
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @property
+    def is_constant(self):
+        return bool(self.flags & CONSTANT)
+
+    @property
+    def is_array(self):
+        return not self.flags & VARIABLE
+
+    @property
+    def byte_aligned(self):
+        return self.bit_offset % 8 == 0 and self.size % 8 == 0
+
+    def __repr__(self):
+        return (
+            f"Field({self.name!r}, {self.kind}, id={self.report_id}, "
+            f"bit={self.bit_offset}, size={self.size}x{self.count})"
+        )
+
+
+class ReportLayout:
+    """同一 (类型, Report ID) 下全部字段的布局；size 不含 Report ID 字节"""
+
+    def __init__(self, kind, report_id):
+        self.kind = kind
+        self.report_id = report_id
+        self.fields = []
+        self.bits = 0
+
+    @property
+    def size(self):
+        return (self.bits + 7) // 8
+
+    def field(self, name):
+        for f in self.fields:
+            if f.name == name:
+                return f
+        raise KeyError(name)
+
+    def key_array(self):
+        """键盘按键数组字段（Keyboard 页的 Data, Array）"""
+        for f in self.fields:
+            if f.usage_page == PAGE_KEYBOARD and f.is_array and not f.is_constant:
+                return f
+        return None
+
+    def key_bitmap(self):
+        """NKRO 按键位图字段（Keyboard 页、修饰键以外的 Data, Variable）"""
+        for f in self.fields:
+            if (
+                f.usage_page == PAGE_KEYBOARD
+                and not f.is_array
+                and not f.is_constant
+                and f.usage_max is not None
+                and f.usage_max < 0xE0
+            ):
+                return f
+        return None
+
+
+class DescriptorLayout:
+    def __init__(self):
+        self.reports = {}
+
+    def report(self, kind, report_id=0):
+        return self.reports[(kind, report_id)]
+
+    def input(self, report_id=0):
+        return self.reports[("input", report_id)]
+
+    def output(self, report_id=0):
+        return self.reports[("output", report_id)]
+
+
+def parse(data, names=None):
+    """解析描述符字节，得到各报文的字段布局；names 依次给 Main 数据条目命名"""
+    layout = DescriptorLayout()
+    names = iter(names or ())
+    glob = {"usage_page": 0, "logical_min": 0, "logical_max": 0, "size": 0, "count": 0,
+            "report_id": 0}
+    stack = []
+    usages = []
+    usage_min = usage_max = None
+    index = 0
+    i = 0
+    while i < len(data):
+        prefix = data[i]
+        length = (0, 1, 2, 4)[prefix & 0x03]
+        raw = bytes(data[i + 1 : i + 1 + length])
+        value = int.from_bytes(raw, "little")
+        signed = int.from_bytes(raw, "little", signed=True)
+        tag, item_type = prefix >> 4, (prefix >> 2) & 0x03
+        i += 1 + length
+
+        if item_type == GLOBAL:
+            if tag == USAGE_PAGE:
+                glob["usage_page"] = value
+            elif tag == LOGICAL_MIN:
+                glob["logical_min"] = signed
+            elif tag == LOGICAL_MAX:
+                # 逻辑最小值非负时按无符号解释（如 0x26 0xFF 0x00）
+                glob["logical_max"] = value if glob["logical_min"] >= 0 else signed
+            elif tag == REPORT_SIZE:
+                glob["size"] = value
+            elif tag == REPORT_ID:
+                glob["report_id"] = value
+            elif tag == REPORT_COUNT:
+                glob["count"] = value
+            elif tag == 0xA:  # Push
+                stack.append(dict(glob))
+            elif tag == 0xB:  # Pop
+                glob = stack.pop()
+            continue
+
+        if item_type == LOCAL:
+            if tag == USAGE:
+                usages.append(value)
+            elif tag == USAGE_MIN:
+                usage_min = value
+            elif tag == USAGE_MAX:
+                usage_max = value
+            continue
+
+        kind = _REPORT_KINDS.get(tag)
+        if kind is not None:
+            key = (kind, glob["report_id"])
+            report = layout.reports.get(key)
+            if report is None:
+                report = layout.reports[key] = ReportLayout(kind, glob["report_id"])
+            report.fields.append(
+                Field(
+                    name=next(names, None) or f"{kind}{index}",
+                    kind=kind,
+                    report_id=glob["report_id"],
+                    bit_offset=report.bits,
+                    size=glob["size"],
+                    count=glob["count"],
+                    flags=value,
+                    usage_page=glob["usage_page"],
+                    usages=tuple(usages),
+                    usage_min=usage_min,
+                    usage_max=usage_max,
+                    logical_min=glob["logical_min"],
+                    logical_max=glob["logical_max"],
+                )
+            )
+            report.bits += glob["size"] * glob["count"]
+            index += 1
+        usages = []
+        usage_min = usage_max = None
+    return layout
+
+
+class DescriptorBuilder:
+    """声明式构建报告描述符，链式调用，build() 返回 (字节, 布局)"""
+
+    def __init__(self):
+        self._items = []
+        self._names = []
+        self._depth = 0
+
+    def _add(self, tag, item_type, value=None, signed=False):
+        self._items.append(_encode_item(tag, item_type, value, signed))
+        return self
+
+    # Global
+    def usage_page(self, page):
+        return self._add(USAGE_PAGE, GLOBAL, page)
+
+    def logical_min(self, value):
+        return self._add(LOGICAL_MIN, GLOBAL, value, signed=True)
+
+    def logical_max(self, value):
+        return self._add(LOGICAL_MAX, GLOBAL, value, signed=True)
+
+    def logical_range(self, lo, hi):
+        return self.logical_min(lo).logical_max(hi)
+
+    def report_size(self, bits):
+        return self._add(REPORT_SIZE, GLOBAL, bits)
+
+    def report_count(self, count):
+        return self._add(REPORT_COUNT, GLOBAL, count)
+
+    def report_id(self, report_id):
+        return self._add(REPORT_ID, GLOBAL, report_id)
+
+    # Local
+    def usage(self, usage):
+        return self._add(USAGE, LOCAL, usage)
+
+    def usage_min(self, usage):
+        return self._add(USAGE_MIN, LOCAL, usage)
+
+    def usage_max(self, usage):
+        return self._add(USAGE_MAX, LOCAL, usage)
+
+    def usage_range(self, lo, hi):
+        return self.usage_min(lo).usage_max(hi)
+
+    # Main
+    def collection(self, kind=APPLICATION):
+        self._depth += 1
+        return self._add(COLLECTION, MAIN, kind)
+
+    def end_collection(self):
+        if not self._depth:
+            raise ValueError("End Collection 没有对应的 Collection")
+        self._depth -= 1
+        return self._add(END_COLLECTION, MAIN)
+
+    def input(self, flags, name=None):
+        self._names.append(name)
+        return self._add(INPUT, MAIN, flags)
+
+    def output(self, flags, name=None):
+        self._names.append(name)
+        return self._add(OUTPUT, MAIN, flags)
+
+    def feature(self, flags, name=None):
+        self._names.append(name)
+        return self._add(FEATURE, MAIN, flags)
+
+    def padding(self, kind, bits):
+        """kind 为 "input" 或 "output" 的常量填充位"""
+        self.report_count(1).report_size(bits)
+        return getattr(self, kind)(CONSTANT)
+
+    def build(self):
+        if self._depth:
+            raise ValueError("Collection 未闭合")
+        data = b"".join(self._items)
+        return data, parse(data, self._names)
+
+
+def _signed(field, raw):
+    """逻辑最小值为负时按补码解释元素值"""
+    if field.logical_min < 0 and raw & (1 << (field.size - 1)):
+        return raw - (1 << field.size)
+    return raw
+
+
+def _in_range(field, value):
+    # Array 字段中 0 表示空槽
+    return field.logical_min <= value <= field.logical_max or (field.is_array and value == 0)
+
+
+def _covers_all(field):
+    if field.logical_min < 0:
+        lo, hi = -(1 << (field.size - 1)), (1 << (field.size - 1)) - 1
+    else:
+        lo, hi = 0, (1 << field.size) - 1
+    return field.logical_min <= lo and field.logical_max >= hi
+
+
+class ReportDecoder:
+    """按布局解码单个报文，或对整块缓冲区中的定长报文批量校验"""
+
+    def __init__(self, report_layout):
+        self.layout = report_layout
+        self.size = report_layout.size
+        self._fields = [f for f in report_layout.fields if not f.is_constant]
+        self._padding = [f for f in report_layout.fields if f.is_constant and f.byte_aligned]
+        # 字节对齐的 8 位字段预先生成查找表：合法值映射为 0，非法值映射为 1；
+        # 其他字段逐个报文检查。取值范围覆盖全部位组合的字段无需检查
+        self._invalid_tables = {}
+        self._checked = []
+        for f in self._fields:
+            if _covers_all(f):
+                continue
+            if f.size == 8 and f.byte_aligned:
+                self._invalid_tables[f.name] = bytes(
+                    0 if _in_range(f, _signed(f, raw)) else 1 for raw in range(256)
+                )
+            else:
+                self._checked.append(f)
+
+    def decode(self, report):
+        """返回 {字段名: 值}；Variable 字段为各元素值列表，Array 字段为非零 Usage 列表"""
+        value = int.from_bytes(report[: self.size], "little")
+        result = {}
+        for f in self._fields:
+            mask = (1 << f.size) - 1
+            items = [(value >> (f.bit_offset + j * f.size)) & mask for j in range(f.count)]
+            if f.is_array:
+                result[f.name] = [v for v in items if v]
+            else:
+                if f.logical_min < 0:
+                    sign = 1 << (f.size - 1)
+                    items = [v - (1 << f.size) if v & sign else v for v in items]
+                result[f.name] = items
+        return result
+
+    def iter_decode(self, buffer):
+        size = self.size
+        decode = self.decode
+        view = memoryview(buffer)
+        for offset in range(0, len(view) - size + 1, size):
+            yield decode(view[offset : offset + size])
+
+    def column(self, buffer, field_name, index=0):
+        """取出所有报文中某个 8 位字段元素，返回 bytes（跨步切片，C 速度）"""
+        f = self.layout.field(field_name)
+        if not (f.size == 8 and f.byte_aligned):
+            raise ValueError(f"{field_name} 不是按字节对齐的 8 位字段")
+        data = bytes(buffer[: len(buffer) - len(buffer) % self.size])
+        return data[f.bit_offset // 8 + index :: self.size]
+
+    def validate_batch(self, buffer):
+        """校验缓冲区中的全部报文，返回第一个非法报文的序号，全部合法时返回 -1
+
+        非法指：某个数据字段的元素超出逻辑最小/最大值（Array 字段允许 0），
+        或按字节对齐的常量填充不为 0。
+        """
+        size = self.size
+        if len(buffer) % size:
+            raise ValueError(f"缓冲区长度 {len(buffer)} 不是报文长度 {size} 的整数倍")
+        data = bytes(buffer)
+        first = -1
+        for f in self._padding:
+            for j in range(f.count * f.size // 8):
+                col = data[f.bit_offset // 8 + j :: size]
+                idx = len(col) - len(col.lstrip(b"\x00"))  # 第一个非零字节
+                if idx < len(col):
+                    first = idx if first < 0 else min(first, idx)
+        for name, table in self._invalid_tables.items():
+            f = self.layout.field(name)
+            for j in range(f.count):
+                flags = data[f.bit_offset // 8 + j :: size].translate(table)
+                idx = flags.find(1)
+                if idx >= 0:
+                    first = idx if first < 0 else min(first, idx)
+        if self._checked:
+            # 位字段和非 8 位字段：只需检查到目前找到的第一个非法报文之前
+            count = len(data) // size if first < 0 else first
+            for idx in range(count):
+                value = int.from_bytes(data[idx * size : (idx + 1) * size], "little")
+                if not self._valid(value):
+                    return idx
+        return first
+
+    def _valid(self, value):
+        for f in self._checked:
+            mask = (1 << f.size) - 1
+            for j in range(f.count):
+                raw = (value >> (f.bit_offset + j * f.size)) & mask
+                if not _in_range(f, _signed(f, raw)):
+                    return False
+        return True
+
+    def unpack_batch(self, buffer):
+        """按报文迭代返回原始字节元组（struct.iter_unpack）"""
+        return struct.iter_unpack(f"{self.size}B", buffer)
@@ -0,0 +1,303 @@
+# ingest.py
+"""Unix 域套接字输入服务：其他进程通过行协议推送按键和文本
+
+每行一个请求，按顺序应答一行 "OK" 或 "ERR <原因>"，可流水线发送：
+    TEXT <文本>          输入文本，支持 \\n \\t \\\\ 转义
+    PRESS <usage>        按下（十进制或 0x 十六进制，不超过当前报告描述符的上限）
+    RELEASE <usage>      抬起
+    TAP <usage>[ ...]    同时按下后全部抬起（组合键）
+    RELEASEALL           抬起全部按键
+    CONSUMER <usage>     多媒体键（组合设备，Consumer Usage 0-0x3FF）
+    MOUSE <dx> <dy> [滚轮]  鼠标相对移动（组合设备）
+    CLICK [按键位图]      鼠标点击，默认左键（组合设备）
+    PING                 仅应答，用于同步
+"""
+import logging
+import os
+import socket
+
+from gi.repository import GLib
+
+from keymap import key_usage_max
+from keystate import MODIFIER_MAX, MODIFIER_MIN
+from report_maps import CONSUMER_USAGE_MAX, REPORT_MAPS
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 65536
+MAX_LINE = 1 << 20  # 单行上限，防止异常客户端占满内存
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "\\": "\\"}
+
+
+def _unescape(text):
+    if "\\" not in text:
+        return text
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            out.append(_ESCAPES.get(text[i + 1], text[i + 1]))
+            i += 2
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def _usage(arg, maximum=0xFF):
+    value = int(arg, 0)
+    if not 0 <= value <= maximum:
+        raise ValueError(f"usage 超出范围: {arg}")
+    return value
+
+
+def _key_usage(arg, maximum):
+    """键盘页 Usage：修饰键或不超过报告描述符上限的普通按键"""
+    value = int(arg, 0)
+    if not (0 <= value <= maximum or MODIFIER_MIN <= value <= MODIFIER_MAX):
+        raise ValueError(f"usage 超出范围: {arg}（普通按键上限 0x{maximum:02X}）")
+    return value
+
+
+def _extra_report(char, name):
+    report = getattr(char.service, name, None)
+    if report is None:
+        raise ValueError("需要以组合设备模式运行（--composite）")
+    return report
+
+
+class _Client:
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.busy = False  # 正在等待文本发送完成或队列腾出空间
+        self.closing = False
+        self._processing = False
+        self._in_watch = GLib.io_add_watch(
+            sock.fileno(), GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_readable
+        )
+        self._out_watch = None
+
+    def _on_readable(self, fd, condition):
+        try:
+            data = self.sock.recv(READ_CHUNK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            self._in_watch = None
+            self.closing = True
+            self._maybe_close()
+            return False
+
+        self.inbuf += data
+        if len(self.inbuf) > MAX_LINE and b"\n" not in self.inbuf:
+            self._reply(b"ERR line too long")
+            self.inbuf.clear()
+        self._process()
+        if self.busy:
+            # 暂停读取：内核缓冲区写满后客户端自然阻塞，实现端到端流控
+            self._in_watch = None
+            return False
+        return True
+
+    def _process(self):
+        self._processing = True
+        try:
+            while not self.busy:
+                end = self.inbuf.find(b"\n")
+                if end < 0:
+                    break
+                line = bytes(self.inbuf[:end]).rstrip(b"\r")
+                del self.inbuf[: end + 1]
+                try:
+                    self._handle(line.decode("utf-8"))
+                except (ValueError, UnicodeDecodeError) as e:
+                    self._reply(f"ERR {e}".encode("utf-8"))
+        finally:
+            self._processing = False
+        self._maybe_close()
+
+    def _handle(self, line):
+        command, _, arg = line.partition(" ")
+        command = command.upper()
+        server = self.server
+        char = server.char
+
+        if command == "TEXT":
+            # 先把已合并的按键状态送进队列，保证与文本的先后顺序
+            char.key_state.flush()
+            self.busy = True
+            try:
+                char.type_text(_unescape(arg), self._on_text_done)
+            except ValueError:
+                self.busy = False
+                raise
+            return
+        if command == "PING":
+            self._reply(b"OK")
+            return
+
+        if command in ("CONSUMER", "MOUSE", "CLICK"):
+            self._handle_extra(command, arg)
+            return
+
+        if char.scheduler.free_slots() < self._needed_slots(char.scheduler):
+            # 队列接近满：等回落到低水位后再继续处理本行
+            self.inbuf[:0] = line.encode("utf-8") + b"\n"
+            self._wait_writable(char.scheduler)
+            return
+
+        key_state = char.key_state
+        maximum = server.key_usage_max
+        if command == "PRESS":
+            key_state.press(_key_usage(arg, maximum))
+        elif command == "RELEASE":
+            key_state.release(_key_usage(arg, maximum))
+        elif command == "TAP":
+            key_state.tap(*[_key_usage(a, maximum) for a in arg.split()])
+        elif command == "RELEASEALL":
+            key_state.release_all()
+        else:
+            raise ValueError(f"未知命令: {command}")
+        self._reply(b"OK")
+
+    def _handle_extra(self, command, arg):
+        """多媒体键和鼠标报文：送入各自的队列，由服务的调度器与键盘报文交替发送"""
+        char = self.server.char
+        if command == "CONSUMER":
+            report = _extra_report(char, "consumerReport")
+            accepted = report.tap(_usage(arg, CONSUMER_USAGE_MAX))
+            slots = 2
+        elif command == "MOUSE":
+            report = _extra_report(char, "mouseReport")
+            values = [int(a, 0) for a in arg.split()]
+            if len(values) not in (2, 3):
+                raise ValueError("用法: MOUSE <dx> <dy> [滚轮]")
+            accepted = report.move(*values)
+            slots = report.report_pool.motion_steps(*values)
+        else:
+            report = _extra_report(char, "mouseReport")
+            accepted = report.click(_usage(arg, 0x1F) if arg else 0x01)
+            slots = 2
+
+        if not accepted:
+            # 队列已满：等回落到低水位、且放得下本行的全部报文后重新处理
+            self.inbuf[:0] = f"{command} {arg}".encode("utf-8") + b"\n"
+            self._wait_writable(report.scheduler, slots)
+            return
+        self._reply(b"OK")
+
+    def _needed_slots(self, scheduler):
+        # 暂停期间队列上限是 pending_capacity，要求的空位不能超过它
+        return min(self.server.min_free_slots, scheduler.pending_capacity)
+
+    def _wait_writable(self, scheduler, slots=0):
+        self.busy = True
+        slots = max(self._needed_slots(scheduler), slots)
+        scheduler.on_writable(self._resume_later, slots)
+
+    def _resume_later(self):
+        # 经主循环继续，避免在 _process 内同步重入
+        GLib.idle_add(self._on_resume_idle)
+
+    def _on_resume_idle(self):
+        self._resume()
+        return False
+
+    def _on_text_done(self):
+        self._reply(b"OK")
+        self._resume()
+
+    def _resume(self):
+        self.busy = False
+        if self.sock is None or self._processing:
+            return  # 同步完成时由外层 _process 循环继续处理
+        self._process()
+        if not self.busy and self._in_watch is None and not self.closing:
+            self._in_watch = GLib.io_add_watch(
+                self.sock.fileno(), GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_readable
+            )
+
+    def _reply(self, line):
+        if self.sock is None:
+            return
+        self.outbuf += line + b"\n"
+        if self._out_watch is None:
+            self._flush_out()
+
+    def _flush_out(self, *args):
+        try:
+            sent = self.sock.send(self.outbuf)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close()
+            return False
+        del self.outbuf[:sent]
+        if self.outbuf:
+            if self._out_watch is None:
+                self._out_watch = GLib.io_add_watch(
+                    self.sock.fileno(), GLib.IO_OUT, self._flush_out
+                )
+            return True
+        self._out_watch = None
+        self._maybe_close()
+        return False
+
+    def _maybe_close(self):
+        if self.closing and not self.busy and not self.outbuf:
+            self.close()
+
+    def close(self):
+        for watch in (self._in_watch, self._out_watch):
+            if watch is not None:
+                GLib.source_remove(watch)
+        self._in_watch = self._out_watch = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.server.clients.discard(self)
+
+
+class IngestServer:
+    """在 GLib 主循环中监听 Unix 套接字，把客户端请求送入 InputReportCharacteristic"""
+
+    def __init__(self, path, char, min_free_slots=64):
+        self.path = path
+        self.char = char
+        self.min_free_slots = min_free_slots
+        # 超出报告描述符范围的按键会被编码时静默丢弃，入口处直接拒绝
+        self.key_usage_max = key_usage_max(REPORT_MAPS[char.report_mode])
+        self.clients = set()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.bind(path)
+        self.sock.listen(128)
+        self._watch = GLib.io_add_watch(self.sock.fileno(), GLib.IO_IN, self._on_accept)
+        logger.info("🔌 输入服务已监听 %s", path)
+
+    def _on_accept(self, fd, condition):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except BlockingIOError:
+                return True
+            conn.setblocking(False)
+            self.clients.add(_Client(self, conn))
+
+    def close(self):
+        GLib.source_remove(self._watch)
+        for client in list(self.clients):
+            client.close()
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,110 @@
+# keymap.py
+from functools import lru_cache
+
+from hid_descriptor import parse
+from report import REPORT_POOL
+
+MOD_LSHIFT = 0x02
+
+PHRASE_CACHE_SIZE = 256  # 缓存的常用短语数量
+PHRASE_MAX_LENGTH = 256  # 超过此长度的文本直接流式生成，不进缓存
+
+# US 键盘布局：字符 -> (修饰键, HID Usage)
+_US_LAYOUT = {
+    "\b": (0x00, 0x2A),
+    "\t": (0x00, 0x2B),
+    "\n": (0x00, 0x28),
+    " ": (0x00, 0x2C),
+    "-": (0x00, 0x2D),
+    "=": (0x00, 0x2E),
+    "[": (0x00, 0x2F),
+    "]": (0x00, 0x30),
+    "\\": (0x00, 0x31),
+    ";": (0x00, 0x33),
+    "'": (0x00, 0x34),
+    "`": (0x00, 0x35),
+    ",": (0x00, 0x36),
+    ".": (0x00, 0x37),
+    "/": (0x00, 0x38),
+    "_": (MOD_LSHIFT, 0x2D),
+    "+": (MOD_LSHIFT, 0x2E),
+    "{": (MOD_LSHIFT, 0x2F),
+    "}": (MOD_LSHIFT, 0x30),
+    "|": (MOD_LSHIFT, 0x31),
+    ":": (MOD_LSHIFT, 0x33),
+    '"': (MOD_LSHIFT, 0x34),
+    "~": (MOD_LSHIFT, 0x35),
+    "<": (MOD_LSHIFT, 0x36),
+    ">": (MOD_LSHIFT, 0x37),
+    "?": (MOD_LSHIFT, 0x38),
+}
+for _i, _c in enumerate("abcdefghijklmnopqrstuvwxyz"):
+    _US_LAYOUT[_c] = (0x00, 0x04 + _i)
+    _US_LAYOUT[_c.upper()] = (MOD_LSHIFT, 0x04 + _i)
+for _i, (_c, _s) in enumerate(zip("1234567890", "!@#$%^&*()")):
+    _US_LAYOUT[_c] = (0x00, 0x1E + _i)
+    _US_LAYOUT[_s] = (MOD_LSHIFT, 0x1E + _i)
+_US_LAYOUT["\r"] = _US_LAYOUT["\n"]
+
+
+def key_usage_max(report_map):
+    """从报告描述符中找出普通按键允许的最大 Usage（6KRO 数组或 NKRO 位图）"""
+    usage_max = 0
+    for report in parse(bytes(report_map)).reports.values():
+        if report.kind != "input":
+            continue
+        keys = report.key_array()
+        if keys is not None:
+            usage_max = max(usage_max, keys.logical_max)
+        bitmap = report.key_bitmap()
+        if bitmap is not None:
+            usage_max = max(usage_max, bitmap.usage_max)
+    return usage_max
+
+
+class Keymap:
+    """字符到 HID 报文的预编译表，带常用短语的 LRU 缓存"""
+
+    def __init__(self, report_map, pool=REPORT_POOL, layout=None):
+        usage_max = key_usage_max(report_map)
+        self.release = pool.release
+        self.table = {}
+        for char, (modifier, usage) in (layout or _US_LAYOUT).items():
+            if usage <= usage_max:
+                self.table[char] = pool.encode(modifier, [usage])
+        self.compile = lru_cache(maxsize=PHRASE_CACHE_SIZE)(self._compile)
+
+    def _compile(self, text):
+        """把文本编译成按下/抬起报文元组（报文对象共享，不重复分配）"""
+        table = self.table
+        release = self.release
+        try:
+            return tuple(r for c in text for r in (table[c], release))
+        except KeyError as e:
+            raise ValueError(f"无法输入的字符: {e.args[0]!r}") from None
+
+    def iter_reports(self, text):
+        """返回文本对应报文的迭代器；短文本走缓存，长文本流式生成"""
+        if len(text) <= PHRASE_MAX_LENGTH:
+            return iter(self.compile(text))
+        missing = set(text).difference(self.table)
+        if missing:
+            raise ValueError(f"无法输入的字符: {sorted(missing)!r}")
+        return self._stream(text)
+
+    def _stream(self, text):
+        table = self.table
+        release = self.release
+        for char in text:
+            yield table[char]
+            yield release
+
+
+@lru_cache(maxsize=None)
+def _keymap_for(report_map, pool):
+    return Keymap(report_map, pool)
+
+
+def get_keymap(report_map, pool=REPORT_POOL):
+    """按报告描述符和报文池获取共享的 Keymap 实例"""
+    return _keymap_for(tuple(report_map), pool)
@@ -0,0 +1,147 @@
+# keystate.py
+from collections import deque
+
+from gi.repository import GLib
+
+from report import ERROR_ROLL_OVER
+from scheduler import DROPPED
+
+MODIFIER_MIN = 0xE0  # Left Control
+MODIFIER_MAX = 0xE7  # Right GUI
+
+
+class KeyState:
+    """按键状态跟踪：同一轮事件循环内的按下/抬起合并为一个报文，重复报文不发送"""
+
+    def __init__(self, char):
+        self.char = char
+        self.pool = char.report_pool
+        self.slots = self.pool.KEY_SLOTS  # NKRO 模式下为 None
+        self.modifiers = 0
+        self.keys = []  # 按下顺序
+        self._sent_modifiers = 0
+        self._sent_keys = ()
+        self._pending = deque()  # 队列已满时记下的中间状态 (报文, 修饰键, 按键)
+        self._last = self.pool.release
+        self._flush_source = None
+        self._waiting_writable = False
+        self.events = 0
+        self.reports = 0
+        self.suppressed = 0
+
+    def press(self, usage):
+        self.events += 1
+        sent_modifiers, sent_keys = self._recorded()
+        if MODIFIER_MIN <= usage <= MODIFIER_MAX:
+            bit = 1 << (usage - MODIFIER_MIN)
+            if self.modifiers & bit:
+                return
+            if sent_modifiers & bit:
+                self._checkpoint()  # 抬起尚未发出，先发出再按下
+            self.modifiers |= bit
+        else:
+            if usage in self.keys:
+                return
+            if usage in sent_keys:
+                self._checkpoint()
+            self.keys.append(usage)
+        self._schedule_flush()
+
+    def release(self, usage):
+        self.events += 1
+        sent_modifiers, sent_keys = self._recorded()
+        if MODIFIER_MIN <= usage <= MODIFIER_MAX:
+            bit = 1 << (usage - MODIFIER_MIN)
+            if not self.modifiers & bit:
+                return
+            if not sent_modifiers & bit:
+                self._checkpoint()  # 按下尚未发出，先发出再抬起
+            self.modifiers &= ~bit
+        else:
+            if usage not in self.keys:
+                return
+            if usage not in sent_keys:
+                self._checkpoint()
+            self.keys.remove(usage)
+        self._schedule_flush()
+
+    def tap(self, *usages):
+        """按下一组键（和弦）后全部抬起"""
+        for usage in usages:
+            self.press(usage)
+        for usage in reversed(usages):
+            self.release(usage)
+
+    def release_all(self):
+        self.modifiers = 0
+        self.keys.clear()
+        self._schedule_flush()
+
+    def encode(self):
+        if self.slots is not None and len(self.keys) > self.slots:
+            return self.pool.encode(self.modifiers, [ERROR_ROLL_OVER] * self.slots)
+        return self.pool.encode(self.modifiers, self.keys)
+
+    def _recorded(self):
+        """最近一次已入队或已记下的 (修饰键, 按键)"""
+        if self._pending:
+            return self._pending[-1][1:]
+        return self._sent_modifiers, self._sent_keys
+
+    def _checkpoint(self):
+        """合并窗口内同一个键先按下后抬起（或反之）：先把当前状态送出"""
+        if not self._pending and self.flush():
+            return
+        # 队列已满：记下中间状态，有空位后按顺序补发，短促的按键不会被合并掉
+        self._pending.append((self.encode(), self.modifiers, tuple(self.keys)))
+
+    def flush(self):
+        """立即把当前状态放入发送队列；与上次报文相同则跳过"""
+        if self._flush_source is not None:
+            GLib.source_remove(self._flush_source)
+            self._flush_source = None
+
+        pending = self._pending
+        while pending:
+            if not self._queue(*pending[0]):
+                return False
+            pending.popleft()
+        return self._queue(self.encode(), self.modifiers)
+
+    def _queue(self, report, modifiers, keys=None):
+        """放入一个报文并记录其状态；keys 为 None 表示当前按键"""
+        if report == self._last:
+            self.suppressed += 1
+            return True
+        result = self.char.queue_report(report)
+        if not result:
+            # 队列已满：等回落到低水位后再发当前状态
+            if not self._waiting_writable:
+                self._waiting_writable = True
+                self.char.scheduler.on_writable(self._on_writable)
+            return False
+        if result is DROPPED:
+            # 缓存已满被丢弃，队尾已换成全部抬起报文：按主机最终看到的状态记录
+            self._last = self.pool.release
+            self._sent_modifiers = 0
+            self._sent_keys = ()
+            return True
+
+        self._last = report
+        self._sent_modifiers = modifiers
+        self._sent_keys = tuple(self.keys) if keys is None else keys
+        self.reports += 1
+        return True
+
+    def _schedule_flush(self):
+        if self._flush_source is None and not self._waiting_writable:
+            self._flush_source = GLib.idle_add(self._on_idle)
+
+    def _on_idle(self):
+        self._flush_source = None
+        self.flush()
+        return False
+
+    def _on_writable(self):
+        self._waiting_writable = False
+        self.flush()
@@ -0,0 +1,216 @@
+# macro.py
+"""宏：把步骤序列预编译成带时间戳的报文数组，LRU 缓存，并由单一回调回放
+
+步骤格式（元组）：
+    ("text", "hello")          输入文本
+    ("tap", 0xE0, 0x17)        组合键：依次按下后全部抬起
+    ("press", 0xE1)            按下
+    ("release", 0xE1)          抬起
+    ("delay", 500)             等待毫秒数
+"""
+from array import array
+from collections import OrderedDict
+
+import timers
+from keystate import MODIFIER_MAX, MODIFIER_MIN
+from report import ERROR_ROLL_OVER
+
+DEFAULT_STEP_MS = 8  # 相邻报文的默认间隔，与报文调度器一致
+DEFAULT_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class CompiledMacro:
+    """平坦的 (时间偏移 ms, 报文) 序列；报文为报文池中的共享对象"""
+
+    __slots__ = ("times", "reports", "nbytes")
+
+    def __init__(self, times, reports):
+        self.times = times
+        self.reports = reports
+        self.nbytes = times.itemsize * len(times) + sum(len(r) for r in reports)
+
+    def __len__(self):
+        return len(self.reports)
+
+    @property
+    def duration_ms(self):
+        return self.times[-1] if self.times else 0
+
+
+def compile_macro(steps, keymap, pool, step_ms=DEFAULT_STEP_MS):
+    """把宏步骤编译为 CompiledMacro"""
+    times = array("L")
+    reports = []
+    t = 0
+    modifiers = 0
+    keys = []
+
+    def emit():
+        nonlocal t
+        if pool.KEY_SLOTS is not None and len(keys) > pool.KEY_SLOTS:
+            report = pool.encode(modifiers, [ERROR_ROLL_OVER] * pool.KEY_SLOTS)
+        else:
+            report = pool.encode(modifiers, keys)
+        if reports and report is reports[-1]:
+            return  # 与上一个报文相同，无需发送
+        times.append(t)
+        reports.append(report)
+        t += step_ms
+
+    def press(usage):
+        nonlocal modifiers
+        if MODIFIER_MIN <= usage <= MODIFIER_MAX:
+            modifiers |= 1 << (usage - MODIFIER_MIN)
+        elif usage not in keys:
+            keys.append(usage)
+        emit()
+
+    def release(usage):
+        nonlocal modifiers
+        if MODIFIER_MIN <= usage <= MODIFIER_MAX:
+            modifiers &= ~(1 << (usage - MODIFIER_MIN))
+        elif usage in keys:
+            keys.remove(usage)
+        emit()
+
+    for step in steps:
+        kind, args = step[0], step[1:]
+        if kind == "text":
+            for report in keymap.compile(args[0]):
+                times.append(t)
+                reports.append(report)
+                t += step_ms
+        elif kind == "tap":
+            for usage in args:
+                press(usage)
+            for usage in reversed(args):
+                release(usage)
+        elif kind == "press":
+            press(args[0])
+        elif kind == "release":
+            release(args[0])
+        elif kind == "delay":
+            t += int(args[0])
+        else:
+            raise ValueError(f"未知的宏步骤: {kind}")
+    return CompiledMacro(times, tuple(reports))
+
+
+class MacroCache:
+    """按编译结果总字节数限制大小的 LRU 缓存"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = build()
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 各键盘共享：编译结果只引用报文池中的共享报文
+MACRO_CACHE = MacroCache()
+
+
+def _freeze(steps):
+    return tuple(tuple(step) for step in steps)
+
+
+class _Playback:
+    __slots__ = ("macro", "start", "index", "done")
+
+    def __init__(self, macro, start, done):
+        self.macro = macro
+        self.start = start
+        self.index = 0
+        self.done = done
+
+
+class MacroPlayer:
+    """在一个 InputReportCharacteristic 上回放宏；所有回放共用一个定时器"""
+
+    def __init__(self, char, cache=None, step_ms=None):
+        self.char = char
+        self.cache = MACRO_CACHE if cache is None else cache
+        self.step_ms = step_ms or char.scheduler.interval_ms
+        self._playing = []
+        self._timer = None
+        self._waiting_writable = False
+
+    def compile(self, steps):
+        steps = _freeze(steps)
+        key = (steps, self.char.report_mode, self.step_ms)
+        return self.cache.get(
+            key,
+            lambda: compile_macro(steps, self.char.keymap, self.char.report_pool, self.step_ms),
+        )
+
+    def play(self, steps, done=None):
+        """编译（或取缓存）并开始回放，结束后调用 done"""
+        macro = steps if isinstance(steps, CompiledMacro) else self.compile(steps)
+        self._playing.append(_Playback(macro, timers.now(), done))
+        self._run()
+
+    def cancel_all(self):
+        self._playing.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _run(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = timers.now()
+        scheduler = self.char.scheduler
+        next_due = None
+        for playback in list(self._playing):
+            times = playback.macro.times
+            reports = playback.macro.reports
+            elapsed_ms = (now - playback.start) // 1_000_000
+            i = playback.index
+            while i < len(reports) and times[i] <= elapsed_ms:
+                if not scheduler.submit(reports[i]):
+                    break
+                i += 1
+            playback.index = i
+            if i >= len(reports):
+                self._playing.remove(playback)
+                if playback.done is not None:
+                    playback.done()
+            elif times[i] <= elapsed_ms:
+                # 队列已满：等调度器腾出空间
+                if not self._waiting_writable:
+                    self._waiting_writable = True
+                    scheduler.on_writable(self._on_writable)
+            else:
+                due = playback.start + times[i] * 1_000_000
+                next_due = due if next_due is None else min(next_due, due)
+
+        if next_due is not None and not self._waiting_writable:
+            self._timer = timers.call_at(next_due, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        self._run()
+
+    def _on_writable(self):
+        self._waiting_writable = False
+        self._run()
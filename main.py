@@ -1,152 +1,505 @@
 # main.py
+import argparse
+import logging
+import os
 import signal
 
 import dbus
-import dbus.mainloop.glib
-from dbus import Dictionary, Signature
 from gi.repository import GLib
 
-from base import Advertisement, Application
-from service import HIDService
+import metrics
+import timers
+from advertising import DEFAULT_ROTATE_MS, NO_OPTIONS, AdvertisementRotator
+from base import DEFAULT_BASE_PATH, Advertisement, Application
+from scheduler import OVERFLOW_BLOCK, OVERFLOW_POLICIES
+
+logger = logging.getLogger(__name__)
 
 BLUEZ_SERVICE_NAME = "org.bluez"
 
 
-def find_adapter(bus):
-    """获取蓝牙适配器路径"""
+def find_adapters(bus):
+    """获取全部蓝牙适配器路径"""
     obj_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, "/"), "org.freedesktop.DBus.ObjectManager"
+        bus.get_object(BLUEZ_SERVICE_NAME, "/", introspect=False),
+        "org.freedesktop.DBus.ObjectManager",
     )
     objects = obj_manager.GetManagedObjects()
-    for path, interfaces in objects.items():
-        if "org.bluez.Adapter1" in interfaces:
-            return path
-    raise Exception("找不到蓝牙适配器")
-
-
-def register_ad_cb():
-    print("📢 广播注册成功")
+    return sorted(
+        path for path, interfaces in objects.items() if "org.bluez.Adapter1" in interfaces
+    )
 
 
-def register_ad_error_cb(error):
-    print(f"❌ 广播注册失败: {error}")
-    mainloop.quit()
+def find_adapter(bus):
+    """获取蓝牙适配器路径"""
+    adapters = find_adapters(bus)
+    if not adapters:
+        raise Exception("找不到蓝牙适配器")
+    return adapters[0]
 
 
-def register_app_cb():
-    print("✅ GATT 服务注册成功")
+PERIODIC_MACRO = (("tap", 0x04),)  # A键
 
 
-def register_app_error_cb(error):
-    print(f"❌ GATT 服务注册失败: {error}")
-    mainloop.quit()
+def start_periodic_key_press(char):
+    playing = False
 
+    def done():
+        nonlocal playing
+        playing = False
 
-def start_periodic_key_press(char):
     def send_key():
-        if not char.notifying:
-            print("⛔ 尚未订阅 Notify，跳过发送")
-            return True  # 等待下一次触发
-
+        nonlocal playing
+        # 尚未订阅时报文留在调度器中，订阅后一次发出；
+        # 上一次还没送完（缓存已满）时跳过本次，避免回放堆积
+        if playing:
+            return True
         # print("⌨️ 发送 HID 报文：A")
-        key_down = [0x00, 0x00, 0x04] + [0x00] * 5  # A键
-        char.send_key_report(key_down)
+        # 预编译的宏：按下与释放由宏回放按节奏送入调度器
+        playing = True
+        char.play_macro(PERIODIC_MACRO, done)
+        return True  # 继续循环定时器
 
-        # 1秒后自动释放
-        def release_key():
-            # print("🔚 发送释放报文")
-            char.send_key_report([0x00] * 8)
-            return False  # 只执行一次
+    # 每 5 秒调用一次 send_key（挂在共享定时器堆上）
+    timers.call_every(5000, send_key)
 
-        GLib.timeout_add(1000, release_key)
-        return True  # 继续循环定时器
 
-    # 每 5 秒调用一次 send_key
-    GLib.timeout_add_seconds(5, send_key)
+def create_keyboard(
+    bus,
+    name="MyBLEKeyboard",
+    base_path=DEFAULT_BASE_PATH,
+    report_mode="6kro",
+    overflow=OVERFLOW_BLOCK,
+    composite=False,
+    alt_names=(),
+):
+    """创建 GATT 应用、HID 服务和广播对象（alt_names 为轮换用的其他广播名称）"""
+    # 按需导入：HID 服务会带入全部特征值、报文池和描述符模块
+    from service import HIDService
 
+    app = Application(bus, base_path)
 
-def shutdown():
-    try:
-        print("🛑 正在清理资源...")
-        adv_manager.UnregisterAdvertisement(adv.get_path())
-        gatt_manager.UnregisterApplication(app.get_path())
-    except Exception as e:
-        print(f"❌ 清理资源时出错: {e}")
-    finally:
-        if mainloop.is_running():
+    hid_service = HIDService(bus, 0, base_path, report_mode, overflow, composite)
+    app.add_service(hid_service)
+
+    advs = []
+    for index, adv_name in enumerate((name, *alt_names)):
+        adv = Advertisement(bus, index, "peripheral", base_path)
+        adv.add_service_uuid(hid_service.HID_UUID)  # HID Service
+
+        adv.set_local_name(adv_name)
+        adv.include_tx_power = True
+        advs.append(adv)
+    return app, hid_service, advs
+
+
+class Keyboard:
+    """绑定到一个适配器的完整键盘实例（独立的对象路径和报文调度器）"""
+
+    def __init__(
+        self,
+        bus,
+        adapter_path,
+        name,
+        report_mode="6kro",
+        overflow=OVERFLOW_BLOCK,
+        composite=False,
+        alt_names=(),
+        rotate_ms=DEFAULT_ROTATE_MS,
+    ):
+        self.bus = bus
+        self.adapter_path = adapter_path
+        self.adapter_name = adapter_path.rsplit("/", 1)[-1]
+        self.failed = False
+        # 尚未收到回复的启动步骤，全部完成即可被连接
+        self.pending = {"powered", "gatt", "advertisement"}
+        self.app, self.hid_service, self.advs = create_keyboard(
+            bus,
+            name,
+            f"{DEFAULT_BASE_PATH}/{self.adapter_name}",
+            report_mode,
+            overflow,
+            composite,
+            alt_names,
+        )
+        metrics.mark(f"{self.adapter_name}.objects_created")
+
+        # 接口已知，不做 Introspect 往返
+        adapter = bus.get_object(BLUEZ_SERVICE_NAME, adapter_path, introspect=False)
+        self.adapter_props = dbus.Interface(adapter, "org.freedesktop.DBus.Properties")
+        self.gatt_manager = dbus.Interface(adapter, "org.bluez.GattManager1")
+        self.adv_manager = dbus.Interface(adapter, "org.bluez.LEAdvertisingManager1")
+        self.rotator = AdvertisementRotator(self.adv_manager, self.advs, rotate_ms)
+
+    def register(self):
+        """上电、GATT 注册和广播注册同时发出，全部异步等待回复
+
+        同一连接上的消息按序到达 BlueZ，因此清理旧广播仍在注册之前处理。
+        代理未做 Introspect，参数类型需显式给出，不能让 dbus-python 猜测。
+        """
+        metrics.mark(f"{self.adapter_name}.register_sent")
+        self.adapter_props.Set(
+            "org.bluez.Adapter1",
+            "Powered",
+            dbus.Boolean(1),
+            signature="ssv",
+            reply_handler=self.powered_cb,
+            error_handler=self.powered_error_cb,
+        )
+
+        logger.info("📡 [%s] 正在注册 GATT 服务……", self.adapter_name)
+        self.gatt_manager.RegisterApplication(
+            self.app.get_path(),
+            NO_OPTIONS,
+            reply_handler=self.register_app_cb,
+            error_handler=self.register_app_error_cb,
+        )
+
+        # 🧹 尝试清理旧广告（避免重启冲突）
+        for adv in self.advs:
+            self.adv_manager.UnregisterAdvertisement(
+                adv.get_path(),
+                reply_handler=lambda: None,
+                error_handler=self.unregister_ad_error_cb,
+            )
+        self.rotator.start(self.register_ad_cb, self.register_ad_error_cb)
+
+    def unregister(self):
+        self.rotator.stop()
+        self.gatt_manager.UnregisterApplication(self.app.get_path())
+
+    def step_done(self, step):
+        metrics.mark(f"{self.adapter_name}.{step}")
+        self.pending.discard(step)
+        if not self.pending:
+            elapsed = metrics.mark(f"{self.adapter_name}.connectable")
+            logger.info("⏱️ [%s] 启动完成，可被连接：%.1f ms", self.adapter_name, elapsed / 1e6)
+
+    def powered_cb(self):
+        self.step_done("powered")
+
+    def powered_error_cb(self, error):
+        logger.error("❌ [%s] 适配器上电失败: %s", self.adapter_name, error)
+        self.fail()
+
+    def unregister_ad_error_cb(self, error):
+        if error.get_dbus_name() != "org.bluez.Error.DoesNotExist":
+            logger.warning("⚠️ 广播取消异常：%s", error)
+        # 没有旧广告，跳过
+
+    def register_ad_cb(self):
+        logger.info("📢 [%s] 广播注册成功", self.adapter_name)
+        self.step_done("advertisement")
+
+    def register_ad_error_cb(self, error):
+        logger.error("❌ [%s] 广播注册失败: %s", self.adapter_name, error)
+        self.fail()
+
+    def register_app_cb(self):
+        logger.info("✅ [%s] GATT 服务注册成功", self.adapter_name)
+        self.step_done("gatt")
+
+    def register_app_error_cb(self, error):
+        logger.error("❌ [%s] GATT 服务注册失败: %s", self.adapter_name, error)
+        self.fail()
+
+    def fail(self):
+        self.failed = True
+        # 所有键盘都失败时退出
+        if all(kb.failed for kb in keyboards):
             mainloop.quit()
 
 
-def main():
-    global mainloop, gatt_manager, adv_manager, app, adv
-    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    bus = dbus.SystemBus()
-    # adapter = find_adapter(bus)
-    adapter_props = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, "/org/bluez/hci0"),
-        "org.freedesktop.DBus.Properties",
-    )
-    # print(adapter_props.GetAll("org.bluez.Adapter1"))
+def dump_metrics():
+    logger.info("📊 运行统计:\n%s", metrics.dump())
+    return True
 
-    adapter_props.Set("org.bluez.Adapter1", "Powered", dbus.Boolean(1))
 
-    gatt_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, "/org/bluez/hci0"), "org.bluez.GattManager1"
-    )
-    adv_manager = dbus.Interface(
-        bus.get_object(BLUEZ_SERVICE_NAME, "/org/bluez/hci0"),
-        "org.bluez.LEAdvertisingManager1",
-    )
+def shutdown():
+    logger.info("🛑 正在清理资源...")
+    for kb in keyboards:
+        try:
+            kb.unregister()
+        except Exception as e:
+            logger.error("❌ [%s] 清理资源时出错: %s", kb.adapter_name, e)
+    if mainloop.is_running():
+        mainloop.quit()
 
-    app = Application(bus)
 
-    hid_service = HIDService(bus, 0)
-    app.add_service(hid_service)
+def mark_mainloop_running():
+    metrics.mark("mainloop_running")
+    return False
 
-    adv = Advertisement(bus, 0, "peripheral")
-    adv.add_service_uuid(hid_service.HID_UUID)  # HID Service
 
-    adv.set_local_name("MyBLEKeyboard")
-    adv.include_tx_power = True
+def setup_logging():
+    logging.basicConfig(
+        level=os.environ.get("BLE_KEYBOARD_LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s",
+    )
 
-    print("📡 正在注册 GATT 服务……")
 
-    # for svc in app.services:
-    #     print(f"\n📦 Service {svc.uuid} @ {svc.get_path()}")
-    #     for ch in svc.characteristics:
-    #         print(f"  ├─ Characteristic {ch.uuid} @ {ch.get_path()}")
-    #         print(f"     Flags: {ch.flags}")
-    #         for desc in getattr(ch, "descriptors", []):
-    #             print(f"     └─ Descriptor {desc.uuid} @ {desc.get_path()}")
-    #             print(f"        Flags: {desc.flags}")
-    #             print(f"        Value: {desc.value}")
+def run_keyboards(
+    adapter_paths,
+    name,
+    report_mode="6kro",
+    socket_path=None,
+    overflow=OVERFLOW_BLOCK,
+    composite=False,
+    record_path=None,
+    replay_path=None,
+    replay_speed=1.0,
+    producers=0,
+    producer_target=None,
+    evdev_path=None,
+    evdev_grab=False,
+    alt_names=(),
+    rotate_ms=DEFAULT_ROTATE_MS,
+    total_adapters=None,
+):
+    """在当前进程中为每个适配器运行一个键盘
+
+    total_adapters 为所有工作进程的适配器总数，决定名称等是否加适配器后缀。
+    """
+    global mainloop, keyboards
+    import dbus.mainloop.glib
+
+    setup_logging()
+    metrics.mark("worker_started")
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    metrics.mark("bus_connected")
+
+    # 按全部进程的适配器数判断：每个工作进程可能只分到一个适配器
+    multiple = (total_adapters or len(adapter_paths)) > 1
+    keyboards = []
+    for adapter_path in adapter_paths:
+        kb_name = name
+        if multiple:
+            kb_name = f"{name}-{adapter_path.rsplit('/', 1)[-1]}"
+        keyboards.append(
+            Keyboard(
+                bus,
+                adapter_path,
+                kb_name,
+                report_mode,
+                overflow,
+                composite,
+                alt_names,
+                rotate_ms,
+            )
+        )
+
+    def per_keyboard(path, kb):
+        return f"{path}.{kb.adapter_name}" if multiple else path
 
-    gatt_manager.RegisterApplication(
-        app.get_path(),
-        {},
-        reply_handler=register_app_cb,
-        error_handler=register_app_error_cb,
-    )
+    mainloop = GLib.MainLoop()
+    servers = []
+    recorders = []
+    consumers = []
+    bridges = []
+    for kb in keyboards:
+        kb.register()
+        if record_path:
+            from report_trace import TraceRecorder
+
+            recorder = TraceRecorder(per_keyboard(record_path, kb))
+            recorder.attach(kb.hid_service)
+            recorders.append(recorder)
+        if evdev_path:
+            from evdev_bridge import EvdevBridge
+
+            bridges.append(
+                EvdevBridge(kb.hid_service.inputReport, evdev_path, evdev_grab)
+            )
+        if socket_path:
+            from ingest import IngestServer
+
+            path = per_keyboard(socket_path, kb)
+            servers.append(IngestServer(path, kb.hid_service.inputReport))
+        elif producers:
+            from shmring import DEFAULT_PRODUCER, RingConsumer
+
+            consumer = RingConsumer(kb.hid_service.inputReport, producers)
+            consumer.start_producers(producer_target or DEFAULT_PRODUCER, report_mode)
+            consumers.append(consumer)
+        elif replay_path:
+            from report_trace import TracePlayer, TraceReader
+
+            player = TracePlayer(
+                TraceReader(replay_path), kb.hid_service.dispatcher, replay_speed
+            )
+            player.play(
+                lambda kb=kb: logger.info("⏹️ [%s] 回放结束", kb.adapter_name)
+            )
+        elif not evdev_path:
+            start_periodic_key_press(kb.hid_service.inputReport)
 
-    # 🧹 尝试清理旧广告（避免重启冲突）
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, shutdown)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, shutdown)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, dump_metrics)
+    GLib.idle_add(mark_mainloop_running)
     try:
-        adv_manager.UnregisterAdvertisement(adv.get_path())
-    except dbus.exceptions.DBusException as e:
-        if "org.bluez.Error.DoesNotExist" in str(e):
-            pass  # 没有旧广告，跳过
-        else:
-            print("⚠️ 广播取消异常：", e)
-    adv_manager.RegisterAdvertisement(
-        adv.get_path(),
-        {},
-        reply_handler=register_ad_cb,
-        error_handler=register_ad_error_cb,
+        mainloop.run()
+    finally:
+        for server in servers:
+            server.close()
+        for recorder in recorders:
+            recorder.close()
+        for consumer in consumers:
+            consumer.close()
+        for bridge in bridges:
+            bridge.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BLE HID 键盘")
+    parser.add_argument(
+        "--adapter",
+        action="append",
+        help="适配器路径或名称（如 hci1），可重复；默认使用第一个适配器",
+    )
+    parser.add_argument("--all-adapters", action="store_true", help="每个适配器运行一个键盘")
+    parser.add_argument("--workers", type=int, default=1, help="分配键盘的工作进程数")
+    parser.add_argument("--name", default="MyBLEKeyboard", help="广播名称")
+    parser.add_argument(
+        "--alt-name",
+        action="append",
+        default=[],
+        help="额外的广播名称，可重复；与 --name 的广播按 --ad-rotate 间隔轮换",
+    )
+    parser.add_argument(
+        "--ad-rotate",
+        type=float,
+        default=DEFAULT_ROTATE_MS / 1000,
+        help="广播轮换间隔（秒）",
+    )
+    parser.add_argument(
+        "--report-mode",
+        choices=("6kro", "nkro"),
+        default="6kro",
+        help="6kro: 标准 6 键报文；nkro: 全键无冲位图报文",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Unix 套接字路径，接收其他进程推送的按键（替代周期性测试按键）",
+    )
+    parser.add_argument(
+        "--overflow",
+        choices=OVERFLOW_POLICIES,
+        default=OVERFLOW_BLOCK,
+        help="主机未订阅期间缓存已满时：block 暂停输入，drop-oldest/drop-newest 丢弃报文",
     )
+    parser.add_argument("--record", help="把发出的输入报文录制到该文件")
+    parser.add_argument(
+        "--replay",
+        help="回放录制文件中的报文（替代周期性测试按键）",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="回放倍速，0 表示不等待、尽快发送",
+    )
+    parser.add_argument(
+        "--evdev",
+        help="转发该输入设备（如 /dev/input/event3）的按键（替代周期性测试按键）",
+    )
+    parser.add_argument(
+        "--evdev-grab",
+        action="store_true",
+        help="独占输入设备，本机不再收到这些按键（仅适用于单个键盘）",
+    )
+    parser.add_argument(
+        "--producers",
+        type=int,
+        default=0,
+        help="报文生产者进程数：经共享内存环送入报文（替代周期性测试按键）",
+    )
+    parser.add_argument(
+        "--producer",
+        default="shmring:periodic_producer",
+        help="生产者函数（模块:函数），以 (producer, index, report_mode) 调用",
+    )
+    parser.add_argument(
+        "--composite",
+        action="store_true",
+        help="组合设备：键盘 + 多媒体键 + 鼠标，共用一个连接",
+    )
+    return parser.parse_args()
 
-    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, shutdown)
-    mainloop = GLib.MainLoop()
-    start_periodic_key_press(hid_service.inputReport)
-    mainloop.run()
+
+def main():
+    args = parse_args()
+    setup_logging()
+
+    if args.adapter:
+        adapters = [a if a.startswith("/") else f"/org/bluez/{a}" for a in args.adapter]
+    else:
+        # 独立连接：共享的 SystemBus 要留给设置了主循环的 run_keyboards
+        bus = dbus.SystemBus(private=True)
+        adapters = find_adapters(bus) if args.all_adapters else [find_adapter(bus)]
+        bus.close()
+
+    workers = max(1, min(args.workers, len(adapters)))
+    if workers == 1:
+        run_keyboards(
+            adapters,
+            args.name,
+            args.report_mode,
+            args.socket,
+            args.overflow,
+            args.composite,
+            args.record,
+            args.replay,
+            args.replay_speed or None,
+            args.producers,
+            args.producer,
+            args.evdev,
+            args.evdev_grab,
+            args.alt_name,
+            args.ad_rotate * 1000,
+            len(adapters),
+        )
+        return
+
+    # 适配器轮流分配到各工作进程，每个进程有独立的 D-Bus 连接和主循环
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(
+            target=run_keyboards,
+            args=(
+                adapters[i::workers],
+                args.name,
+                args.report_mode,
+                args.socket,
+                args.overflow,
+                args.composite,
+                args.record,
+                args.replay,
+                args.replay_speed or None,
+                args.producers,
+                args.producer,
+                args.evdev,
+                args.evdev_grab,
+                args.alt_name,
+                args.ad_rotate * 1000,
+                len(adapters),
+            ),
+            name=f"keyboard-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        # 子进程同样收到 SIGINT，各自清理后退出
+        for proc in procs:
+            proc.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+# metrics.py
+import os
+import time
+
+BUCKETS = 40  # 以 2 的幂划分（纳秒），最高约 550 秒
+
+
+class Histogram:
+    """按 2 的幂分桶的延迟直方图（纳秒），记录一次只需一次 bit_length"""
+
+    __slots__ = ("name", "count", "total", "max", "buckets")
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * BUCKETS
+
+    def observe(self, ns):
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        self.buckets[min(ns.bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        """返回第 p 百分位所在桶的上界（纳秒）"""
+        if not self.count:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(1 << i, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ns": self.total // self.count if self.count else 0,
+            "p50_ns": self.percentile(50),
+            "p99_ns": self.percentile(99),
+            "max_ns": self.max,
+        }
+
+
+_histograms = {}
+_counters = {}
+_method_histograms = {}
+_timeline = []  # (名称, 距进程启动的纳秒数)
+
+
+def process_start_ns():
+    """进程启动时刻（单调时钟纳秒，精度为一个时钟滴答）；读不到 /proc 时返回当前时刻"""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        since_boot = int(fields[19]) * 1_000_000_000 // os.sysconf("SC_CLK_TCK")
+        uptime = time.clock_gettime_ns(time.CLOCK_BOOTTIME)
+        return time.monotonic_ns() - (uptime - since_boot)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic_ns()
+
+
+_origin = process_start_ns()
+
+
+def histogram(name):
+    h = _histograms.get(name)
+    if h is None:
+        h = _histograms[name] = Histogram(name)
+    return h
+
+
+def incr(name, n=1):
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def mark(name):
+    """在时间线上记录一个阶段（如启动各步骤），返回距进程启动的纳秒数"""
+    elapsed = time.monotonic_ns() - _origin
+    _timeline.append((name, elapsed))
+    return elapsed
+
+
+def timeline():
+    return list(_timeline)
+
+
+def snapshot():
+    return {
+        "counters": dict(_counters),
+        "histograms": {name: h.summary() for name, h in _histograms.items()},
+        "timeline": [{"name": name, "ns": ns} for name, ns in _timeline],
+    }
+
+
+def reset():
+    _histograms.clear()
+    _counters.clear()
+    _method_histograms.clear()
+    _timeline.clear()
+
+
+def dump():
+    """以文本形式输出全部计数器、直方图和时间线"""
+    lines = []
+    for name in sorted(_counters):
+        lines.append(f"{name} {_counters[name]}")
+    for name in sorted(_histograms):
+        s = _histograms[name].summary()
+        lines.append(
+            f"{name} count={s['count']} mean={s['mean_ns'] / 1000:.1f}us "
+            f"p50<={s['p50_ns'] / 1000:.1f}us p99<={s['p99_ns'] / 1000:.1f}us "
+            f"max={s['max_ns'] / 1000:.1f}us"
+        )
+    for name, ns in _timeline:
+        lines.append(f"timeline {name} +{ns / 1e6:.1f}ms")
+    return "\n".join(lines)
+
+
+class InstrumentedObject:
+    """混入 dbus.service.Object：统计每个 D-Bus 方法的调用次数和耗时"""
+
+    def _message_cb(self, connection, message):
+        start = time.perf_counter_ns()
+        try:
+            super()._message_cb(connection, message)
+        finally:
+            key = (type(self).__name__, message.get_member())
+            h = _method_histograms.get(key)
+            if h is None:
+                h = _method_histograms[key] = histogram(f"dbus.{key[0]}.{key[1]}")
+            h.observe(time.perf_counter_ns() - start)
+
@@ -0,0 +1,219 @@
+# mock_bluez.py
+"""在私有 dbus-daemon 上模拟 org.bluez：GattManager1、LEAdvertisingManager1 和一个订阅输入报文的 central"""
+import argparse
+import logging
+import os
+import time
+
+import dbus
+import dbus.bus
+import dbus.exceptions
+import dbus.mainloop.glib
+import dbus.service
+from gi.repository import GLib
+
+logger = logging.getLogger(__name__)
+
+BLUEZ_SERVICE_NAME = "org.bluez"
+ADAPTER_IFACE = "org.bluez.Adapter1"
+GATT_MANAGER_IFACE = "org.bluez.GattManager1"
+LE_ADVERTISING_MANAGER_IFACE = "org.bluez.LEAdvertisingManager1"
+GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
+LE_ADVERTISEMENT_IFACE = "org.bluez.LEAdvertisement1"
+DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+BENCH_IFACE = "org.bluez.example.Bench"
+
+INPUT_REPORT_UUID = "2A4D"
+DEFAULT_MTU = 23
+
+
+class MockAdapter(dbus.service.Object):
+    """/org/bluez/hciN：适配器属性、GATT 管理和广播管理"""
+
+    def __init__(self, bus, path, notify_mode):
+        super().__init__(bus, path)
+        self.bus = bus
+        self.notify_mode = notify_mode
+        self.powered = False
+        self.applications = {}
+        self.advertisements = {}
+        self.received = []  # central 收到每个报文的时间（monotonic ns）
+        self.subscribed = False
+        self._notify_io = None
+
+    # -- org.freedesktop.DBus.Properties --
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="ssv")
+    def Set(self, interface, prop, value):
+        if interface == ADAPTER_IFACE and prop == "Powered":
+            self.powered = bool(value)
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="ss", out_signature="v")
+    def Get(self, interface, prop):
+        if interface == ADAPTER_IFACE and prop == "Powered":
+            return dbus.Boolean(self.powered)
+        raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.InvalidArgs")
+
+    # -- org.bluez.GattManager1 --
+
+    @dbus.service.method(
+        GATT_MANAGER_IFACE,
+        in_signature="oa{sv}",
+        sender_keyword="sender",
+        async_callbacks=("reply", "error"),
+    )
+    def RegisterApplication(self, path, options, sender, reply, error):
+        om = dbus.Interface(self.bus.get_object(sender, path), DBUS_OM_IFACE)
+
+        def on_objects(objects):
+            self.applications[(sender, path)] = objects
+            reply()
+            self._subscribe(sender, objects)
+
+        om.GetManagedObjects(reply_handler=on_objects, error_handler=error)
+
+    @dbus.service.method(GATT_MANAGER_IFACE, in_signature="o", sender_keyword="sender")
+    def UnregisterApplication(self, path, sender):
+        self.applications.pop((sender, path), None)
+
+    # -- org.bluez.LEAdvertisingManager1 --
+
+    @dbus.service.method(
+        LE_ADVERTISING_MANAGER_IFACE,
+        in_signature="oa{sv}",
+        sender_keyword="sender",
+        async_callbacks=("reply", "error"),
+    )
+    def RegisterAdvertisement(self, path, options, sender, reply, error):
+        props = dbus.Interface(self.bus.get_object(sender, path), DBUS_PROP_IFACE)
+
+        def on_props(values):
+            self.advertisements[(sender, path)] = values
+            reply()
+
+        props.GetAll(LE_ADVERTISEMENT_IFACE, reply_handler=on_props, error_handler=error)
+
+    @dbus.service.method(
+        LE_ADVERTISING_MANAGER_IFACE, in_signature="o", sender_keyword="sender"
+    )
+    def UnregisterAdvertisement(self, path, sender):
+        if self.advertisements.pop((sender, path), None) is None:
+            raise dbus.exceptions.DBusException(
+                "Advertisement not registered", name="org.bluez.Error.DoesNotExist"
+            )
+
+    # -- central：订阅输入报文 --
+
+    def _subscribe(self, sender, objects):
+        for path, ifaces in objects.items():
+            chrc = ifaces.get(GATT_CHRC_IFACE)
+            if chrc is None or str(chrc["UUID"]).upper() != INPUT_REPORT_UUID:
+                continue
+            proxy = dbus.Interface(self.bus.get_object(sender, path), GATT_CHRC_IFACE)
+            # 即使拿到了 fd，socket 写满时应用也会回退到信号，所以始终监听
+            self.bus.add_signal_receiver(
+                self._on_properties_changed,
+                signal_name="PropertiesChanged",
+                bus_name=sender,
+                path=path,
+            )
+            if self.notify_mode == "acquire" and "NotifyAcquired" in chrc:
+                proxy.AcquireNotify(
+                    {"mtu": dbus.UInt16(DEFAULT_MTU)},
+                    reply_handler=self._on_notify_acquired,
+                    error_handler=self._on_error,
+                )
+            else:
+                proxy.StartNotify(
+                    reply_handler=self._on_notify_started, error_handler=self._on_error
+                )
+            return
+
+    def _on_properties_changed(self, interface, changed, invalidated):
+        if "Value" in changed:
+            self.received.append(time.monotonic_ns())
+
+    def _on_notify_started(self):
+        self.subscribed = True
+
+    def _on_notify_acquired(self, fd, mtu):
+        self.subscribed = True
+        fd = fd.take()
+        os.set_blocking(fd, False)
+        self._notify_io = GLib.io_add_watch(fd, GLib.IO_IN | GLib.IO_HUP, self._on_notify_io)
+
+    def _on_notify_io(self, fd, condition):
+        if condition & GLib.IO_HUP:
+            os.close(fd)
+            return False
+        received = self.received
+        while True:
+            try:
+                os.read(fd, DEFAULT_MTU)
+            except BlockingIOError:
+                return True
+            received.append(time.monotonic_ns())
+
+    def _on_error(self, error):
+        logger.error("central 订阅失败: %s", error)
+
+    # -- 基准测试控制接口 --
+
+    @dbus.service.method(BENCH_IFACE, out_signature="b")
+    def IsSubscribed(self):
+        return self.subscribed
+
+    @dbus.service.method(BENCH_IFACE, out_signature="u")
+    def ReceivedCount(self):
+        return len(self.received)
+
+    @dbus.service.method(BENCH_IFACE, out_signature="at")
+    def TakeReceived(self):
+        received, self.received = self.received, []
+        return dbus.Array(received, signature="t")
+
+    @dbus.service.method(
+        BENCH_IFACE,
+        in_signature="ou",
+        out_signature="at",
+        sender_keyword="sender",
+        async_callbacks=("reply", "error"),
+    )
+    def TimeGetManagedObjects(self, path, count, sender, reply, error):
+        """按 BlueZ 的方式连续调用 count 次 GetManagedObjects，返回每次耗时（ns）"""
+        om = dbus.Interface(self.bus.get_object(sender, path), DBUS_OM_IFACE)
+        samples = []
+
+        def call():
+            start = time.monotonic_ns()
+
+            def done(objects):
+                samples.append(time.monotonic_ns() - start)
+                if len(samples) < count:
+                    call()
+                else:
+                    reply(dbus.Array(samples, signature="t"))
+
+            om.GetManagedObjects(reply_handler=done, error_handler=error)
+
+        call()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--address", required=True, help="私有 dbus-daemon 地址")
+    parser.add_argument("--adapter", default="/org/bluez/hci0")
+    parser.add_argument("--notify-mode", choices=("acquire", "signal"), default="acquire")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(args.address)
+    adapter = MockAdapter(bus, args.adapter, args.notify_mode)  # noqa: F841
+    name = dbus.service.BusName(BLUEZ_SERVICE_NAME, bus)  # noqa: F841
+    GLib.MainLoop().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# report.py
+import struct
+
+import dbus
+
+REPORT_SIZE = 8
+NKRO_BITMAP_BYTES = 16  # Usage 0x00-0x7F 各占 1 位
+NKRO_REPORT_SIZE = 1 + NKRO_BITMAP_BYTES
+CONSUMER_REPORT_SIZE = 2  # 一个 16 位 Consumer Usage
+MOUSE_REPORT_SIZE = 4  # [按键, X, Y, 滚轮]
+MOUSE_AXIS_MAX = 127
+MAX_CACHED_REPORTS = 4096
+ERROR_ROLL_OVER = 0x01
+BOOT_KEY_USAGE_MAX = 0x65  # Boot 键盘报文描述符的按键上限
+
+KEY_RELEASE = bytes(REPORT_SIZE)  # 全部按键抬起
+KEY_DOWN = tuple(
+    bytes([0x00, 0x00, usage]) + bytes(REPORT_SIZE - 3) for usage in range(256)
+)  # 单键按下，按 Usage 索引
+
+NO_INVALIDATED = dbus.Array([], signature="s")
+
+
+class ReportPool:
+    """报文驻留池：复用常用报文对象及其 PropertiesChanged 参数，并统计分配次数"""
+
+    REPORT_SIZE = REPORT_SIZE
+    KEY_SLOTS = 6  # 每个报文最多容纳的普通按键数，None 表示不限
+    release = KEY_RELEASE
+    key_down = KEY_DOWN
+
+    def __init__(self, max_cached=MAX_CACHED_REPORTS):
+        self.max_cached = max_cached
+        self.buffer = bytearray(self.REPORT_SIZE)  # encode() 原地写入的缓冲区
+        self._interned = {}
+        self._encoded = {}  # (修饰键, 按键...) -> 驻留报文
+        self._changed = {}
+        self.hits = 0
+        self.report_allocations = 0
+        self.dbus_allocations = 0
+
+        self.intern(self.release)
+        for report in self.key_down:
+            self.intern(report)
+
+    def intern(self, report):
+        """返回与 report 内容相同的共享 bytes 对象"""
+        try:
+            interned = self._interned.get(report)
+        except TypeError:  # bytearray / list
+            report = bytes(report)
+            interned = self._interned.get(report)
+        if interned is not None:
+            return interned
+        report = bytes(report)
+        if len(self._interned) < self.max_cached:
+            self._interned[report] = report
+        return report
+
+    def encode(self, modifiers, keys):
+        """编码报文；常见报文直接返回驻留对象
+
+        按键数超过 KEY_SLOTS 时返回 ErrorRollOver 报文（HID 规范的幻键状态）。
+        """
+        if self.KEY_SLOTS is not None and len(keys) > self.KEY_SLOTS:
+            keys = [ERROR_ROLL_OVER] * self.KEY_SLOTS
+        if not modifiers:
+            if not keys:
+                return self.release
+            if len(keys) == 1:
+                return self.key_down[keys[0]]
+
+        # 按 (修饰键, 按键) 查缓存，命中时不再生成新的 bytes
+        key = (modifiers, *keys)
+        report = self._encoded.get(key)
+        if report is not None:
+            return report
+        buf = self.buffer
+        self._fill(buf, modifiers, keys)
+        self.report_allocations += 1
+        report = self.intern(bytes(buf))
+        if len(self._encoded) < self.max_cached:
+            self._encoded[key] = report
+        return report
+
+    def _fill(self, buf, modifiers, keys):
+        # [修饰键, 保留, 键1..键6]
+        buf[0] = modifiers
+        count = len(keys)
+        buf[2 : 2 + count] = keys
+        buf[2 + count :] = KEY_RELEASE[2 + count :]
+
+    def to_boot(self, report):
+        """转换成 Boot 协议的 8 字节报文（本布局与之相同）"""
+        return report
+
+    def changed_properties(self, report):
+        """返回可直接用于 PropertiesChanged 的 {'Value': ay} 字典"""
+        try:
+            props = self._changed.get(report)
+        except TypeError:  # list 等不可哈希类型
+            report = bytes(report)
+            self.report_allocations += 1
+            props = self._changed.get(report)
+
+        if props is not None:
+            self.hits += 1
+            return props
+
+        self.dbus_allocations += 1
+        props = {"Value": dbus.ByteArray(report)}
+        if len(self._changed) < self.max_cached and report in self._interned:
+            self._changed[report] = props
+        return props
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "report_allocations": self.report_allocations,
+            "dbus_allocations": self.dbus_allocations,
+            "interned": len(self._interned),
+            "cached_payloads": len(self._changed),
+        }
+
+
+class NKROReportPool(ReportPool):
+    """NKRO 报文：[修饰键, 16 字节 Usage 位图]，按键数不受 6 个槽位限制"""
+
+    REPORT_SIZE = NKRO_REPORT_SIZE
+    KEY_SLOTS = None
+    release = bytes(NKRO_REPORT_SIZE)
+    key_down = tuple(
+        bytes(1 + (usage >> 3))
+        + bytes([1 << (usage & 7)])
+        + bytes(NKRO_BITMAP_BYTES - 1 - (usage >> 3))
+        if usage < NKRO_BITMAP_BYTES * 8
+        else bytes(NKRO_REPORT_SIZE)
+        for usage in range(256)
+    )
+
+    def __init__(self, max_cached=MAX_CACHED_REPORTS):
+        super().__init__(max_cached)
+        self._boot = {}
+
+    def to_boot(self, report):
+        """位图转换为 [修饰键, 保留, 键1..键6]，超过 6 个键时报 ErrorRollOver
+
+        Boot 协议放不下的 Usage（> 0x65）不转发。
+        """
+        boot = self._boot.get(report)
+        if boot is not None:
+            return boot
+        keys = [
+            (i << 3) | bit
+            for i, byte in enumerate(report[1:])
+            if byte
+            for bit in range(8)
+            if byte & (1 << bit) and (i << 3) | bit <= BOOT_KEY_USAGE_MAX
+        ]
+        if len(keys) > REPORT_POOL.KEY_SLOTS:
+            keys = [ERROR_ROLL_OVER] * REPORT_POOL.KEY_SLOTS
+        boot = REPORT_POOL.encode(report[0], keys)
+        if len(self._boot) < self.max_cached:
+            self._boot[bytes(report)] = boot
+        return boot
+
+    def _fill(self, buf, modifiers, keys):
+        # 在预分配缓冲区中原地置位
+        buf[:] = self.release
+        buf[0] = modifiers
+        for usage in keys:
+            if usage < NKRO_BITMAP_BYTES * 8:
+                buf[1 + (usage >> 3)] |= 1 << (usage & 7)
+
+
+class ConsumerReportPool(ReportPool):
+    """Consumer Control 报文：一个小端 16 位 Usage，0 表示全部抬起"""
+
+    REPORT_SIZE = CONSUMER_REPORT_SIZE
+    KEY_SLOTS = 1
+    release = bytes(CONSUMER_REPORT_SIZE)
+    key_down = ()
+
+    def encode(self, usage):
+        return self.intern(usage.to_bytes(CONSUMER_REPORT_SIZE, "little"))
+
+
+class MouseReportPool(ReportPool):
+    """相对坐标鼠标报文：[按键位图, X, Y, 滚轮]，位移为有符号 8 位"""
+
+    REPORT_SIZE = MOUSE_REPORT_SIZE
+    KEY_SLOTS = None
+    release = bytes(MOUSE_REPORT_SIZE)
+    key_down = ()
+    _struct = struct.Struct("<Bbbb")
+
+    def encode(self, buttons, dx=0, dy=0, wheel=0):
+        report = self._struct.pack(buttons, dx, dy, wheel)
+        if dx or dy or wheel:
+            return report  # 位移报文几乎不重复，不驻留
+        return self.intern(report)
+
+    def motion_steps(self, dx, dy, wheel=0):
+        """encode_motion 拆分出的报文个数"""
+        return max(1, -(-max(abs(dx), abs(dy), abs(wheel)) // MOUSE_AXIS_MAX))
+
+    def encode_motion(self, buttons, dx, dy, wheel=0):
+        """把任意大小的位移拆成若干个不超过 ±127 的报文"""
+        reports = []
+        while True:
+            step_x = max(-MOUSE_AXIS_MAX, min(MOUSE_AXIS_MAX, dx))
+            step_y = max(-MOUSE_AXIS_MAX, min(MOUSE_AXIS_MAX, dy))
+            step_w = max(-MOUSE_AXIS_MAX, min(MOUSE_AXIS_MAX, wheel))
+            reports.append(self.encode(buttons, step_x, step_y, step_w))
+            dx -= step_x
+            dy -= step_y
+            wheel -= step_w
+            if not (dx or dy or wheel):
+                return reports
+
+
+REPORT_POOL = ReportPool()
+NKRO_REPORT_POOL = NKROReportPool()
+CONSUMER_REPORT_POOL = ConsumerReportPool()
+MOUSE_REPORT_POOL = MouseReportPool()
+REPORT_POOLS = {"6kro": REPORT_POOL, "nkro": NKRO_REPORT_POOL}
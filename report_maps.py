@@ -0,0 +1,157 @@
+# report_maps.py
+from hid_descriptor import (
+    ABSOLUTE,
+    ARRAY,
+    CONSTANT,
+    DATA,
+    PAGE_BUTTON,
+    PAGE_CONSUMER,
+    PAGE_GENERIC_DESKTOP,
+    PAGE_KEYBOARD,
+    PAGE_LED,
+    PHYSICAL,
+    RELATIVE,
+    VARIABLE,
+    DescriptorBuilder,
+)
+from report import MOUSE_AXIS_MAX, NKRO_BITMAP_BYTES
+
+USAGE_POINTER = 0x01
+USAGE_MOUSE = 0x02
+USAGE_KEYBOARD = 0x06
+USAGE_X, USAGE_Y, USAGE_WHEEL = 0x30, 0x31, 0x38
+USAGE_CONSUMER_CONTROL = 0x01
+CONSUMER_USAGE_MAX = 0x3FF
+MOUSE_BUTTONS = 5
+
+# 组合设备中各输入报文的 Report ID
+REPORT_ID_KEYBOARD = 1
+REPORT_ID_CONSUMER = 2
+REPORT_ID_MOUSE = 3
+
+
+def _keyboard_collection(builder, report_id=None):
+    builder.usage_page(PAGE_GENERIC_DESKTOP).usage(USAGE_KEYBOARD).collection()
+    if report_id is not None:
+        builder.report_id(report_id)
+    return builder
+
+
+def keyboard_6kro(builder=None, report_id=None):
+    """标准 6KRO 键盘：修饰键 + 保留字节 + LED 输出 + 6 个按键槽"""
+    return (
+        _keyboard_collection(builder or DescriptorBuilder(), report_id)
+        .usage_page(PAGE_KEYBOARD)
+        .usage_range(0xE0, 0xE7)
+        .logical_range(0, 1)
+        .report_size(1)
+        .report_count(8)
+        .input(DATA | VARIABLE | ABSOLUTE, "modifiers")
+        .report_count(1)
+        .report_size(8)
+        .input(CONSTANT | VARIABLE, "reserved")
+        .report_count(5)
+        .report_size(1)
+        .usage_page(PAGE_LED)
+        .usage_range(0x01, 0x05)
+        .output(DATA | VARIABLE | ABSOLUTE, "leds")
+        .report_count(1)
+        .report_size(3)
+        .output(CONSTANT | VARIABLE, "led_padding")
+        .report_count(6)
+        .report_size(8)
+        .logical_range(0, 0x65)
+        .usage_page(PAGE_KEYBOARD)
+        .usage_range(0x00, 0x65)
+        .input(DATA | ARRAY, "keys")
+        .end_collection()
+    )
+
+
+def keyboard_nkro(builder=None, report_id=None):
+    """NKRO 键盘：修饰键 + LED 输出 + Usage 0x00-0x7F 位图，每个按键一位"""
+    return (
+        _keyboard_collection(builder or DescriptorBuilder(), report_id)
+        .usage_page(PAGE_KEYBOARD)
+        .usage_range(0xE0, 0xE7)
+        .logical_range(0, 1)
+        .report_size(1)
+        .report_count(8)
+        .input(DATA | VARIABLE | ABSOLUTE, "modifiers")
+        .report_count(5)
+        .report_size(1)
+        .usage_page(PAGE_LED)
+        .usage_range(0x01, 0x05)
+        .output(DATA | VARIABLE | ABSOLUTE, "leds")
+        .report_count(1)
+        .report_size(3)
+        .output(CONSTANT | VARIABLE, "led_padding")
+        .usage_page(PAGE_KEYBOARD)
+        .usage_range(0x00, NKRO_BITMAP_BYTES * 8 - 1)
+        .logical_range(0, 1)
+        .report_size(1)
+        .report_count(NKRO_BITMAP_BYTES * 8)
+        .input(DATA | VARIABLE | ABSOLUTE, "keys")
+        .end_collection()
+    )
+
+
+def consumer_control(builder, report_id=REPORT_ID_CONSUMER):
+    """多媒体键：一个 16 位 Consumer Usage（音量、播放/暂停等）"""
+    return (
+        builder.usage_page(PAGE_CONSUMER)
+        .usage(USAGE_CONSUMER_CONTROL)
+        .collection()
+        .report_id(report_id)
+        .usage_range(0, CONSUMER_USAGE_MAX)
+        .logical_range(0, CONSUMER_USAGE_MAX)
+        .report_size(16)
+        .report_count(1)
+        .input(DATA | ARRAY | ABSOLUTE, "consumer")
+        .end_collection()
+    )
+
+
+def mouse(builder, report_id=REPORT_ID_MOUSE):
+    """相对坐标鼠标：5 个按键 + X/Y/滚轮"""
+    return (
+        builder.usage_page(PAGE_GENERIC_DESKTOP)
+        .usage(USAGE_MOUSE)
+        .collection()
+        .report_id(report_id)
+        .usage(USAGE_POINTER)
+        .collection(PHYSICAL)
+        .usage_page(PAGE_BUTTON)
+        .usage_range(1, MOUSE_BUTTONS)
+        .logical_range(0, 1)
+        .report_size(1)
+        .report_count(MOUSE_BUTTONS)
+        .input(DATA | VARIABLE | ABSOLUTE, "buttons")
+        .padding("input", 8 - MOUSE_BUTTONS)
+        .usage_page(PAGE_GENERIC_DESKTOP)
+        .usage(USAGE_X)
+        .usage(USAGE_Y)
+        .usage(USAGE_WHEEL)
+        .logical_range(-MOUSE_AXIS_MAX, MOUSE_AXIS_MAX)
+        .report_size(8)
+        .report_count(3)
+        .input(DATA | VARIABLE | RELATIVE, "axes")
+        .end_collection()
+        .end_collection()
+    )
+
+
+def composite(report_mode="6kro"):
+    """组合设备：键盘、多媒体键和鼠标各一个 Report ID，共用一个 HID 服务"""
+    keyboard = keyboard_nkro if report_mode == "nkro" else keyboard_6kro
+    builder = keyboard(DescriptorBuilder(), REPORT_ID_KEYBOARD)
+    consumer_control(builder)
+    mouse(builder)
+    return builder.build()
+
+
+KEYBOARD_6KRO, KEYBOARD_6KRO_LAYOUT = keyboard_6kro().build()
+KEYBOARD_NKRO, KEYBOARD_NKRO_LAYOUT = keyboard_nkro().build()
+
+REPORT_MAPS = {"6kro": KEYBOARD_6KRO, "nkro": KEYBOARD_NKRO}
+COMPOSITE_REPORT_MAPS = {mode: composite(mode)[0] for mode in REPORT_MAPS}
@@ -0,0 +1,218 @@
+# report_trace.py
+"""输入报文的二进制录制与回放
+
+文件格式（小端）：32 字节文件头 + 若干 32 字节定长记录
+    文件头: magic(8) 版本(u32) 记录长度(u32) 开始时间 ns(u64) 保留(8)
+    记录:   时间戳 ns(u64) 报文长度(u8) Report ID(u8) 报文(22，不足补 0)
+
+回放通过 mmap 按需读取，GB 级的文件也不会整体载入内存。
+
+    python3 report_trace.py info trace.bin
+    python3 report_trace.py diff a.bin b.bin
+"""
+import argparse
+import mmap
+import struct
+import sys
+import time
+
+MAGIC = b"BLEKTRC\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ8x")
+RECORD = struct.Struct("<QBB22s")
+RECORD_SIZE = RECORD.size
+MAX_PAYLOAD = RECORD_SIZE - 10
+
+WRITE_BUFFER = 1 << 20
+
+
+class TraceRecorder:
+    """追加写入报文记录；attach() 挂到 ReportCharacteristic 的发送钩子上"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb", buffering=WRITE_BUFFER)
+        self.start = time.monotonic_ns()
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, self.start))
+        self.records = 0
+        self._attached = []
+
+    def record(self, report, report_id=0, timestamp=None):
+        if len(report) > MAX_PAYLOAD:
+            raise ValueError(f"报文过长: {len(report)} 字节")
+        self.file.write(
+            RECORD.pack(timestamp or time.monotonic_ns(), len(report), report_id, bytes(report))
+        )
+        self.records += 1
+
+    def _on_report(self, char, report):
+        self.record(report, char.REPORT_ID)
+
+    def attach(self, service):
+        """录制服务中全部输入报文特征值实际发出的报文"""
+        for char in service.characteristics:
+            hooks = getattr(char, "report_hooks", None)
+            if hooks is not None:
+                hooks.append(self._on_report)
+                self._attached.append(char)
+
+    def close(self):
+        for char in self._attached:
+            char.report_hooks.remove(self._on_report)
+        self._attached.clear()
+        self.file.close()
+
+
+class TraceReader:
+    """以 mmap 只读打开录制文件，按下标或迭代访问记录"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.start = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"不是有效的录制文件: {path}")
+        self.count = (len(self.map) - HEADER.size) // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """返回 (时间戳, Report ID, 报文)"""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        timestamp, length, report_id, payload = RECORD.unpack_from(
+            self.map, HEADER.size + index * RECORD_SIZE
+        )
+        return timestamp, report_id, payload[:length]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def duration_ns(self):
+        if not self.count:
+            return 0
+        return self[self.count - 1][0] - self[0][0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class TracePlayer:
+    """把录制的报文送回各 Report ID 的发送队列
+
+    speed 为回放倍速，None 表示不等待、只受发送队列背压限制。
+    """
+
+    def __init__(self, reader, dispatcher, speed=1.0):
+        # 回放依赖 GLib 主循环和 dbus，info/diff 命令不需要
+        import timers
+        from report_maps import REPORT_ID_KEYBOARD
+
+        self.timers = timers
+        self.fallback_id = REPORT_ID_KEYBOARD  # Boot 报文（ID 0）由键盘队列产生
+        self.reader = reader
+        self.dispatcher = dispatcher
+        self.speed = speed
+        self.index = 0
+        self.start = None
+        self.done = None
+        self.skipped = 0
+        self._timer = None
+        self._waiting_writable = False
+
+    def play(self, done=None):
+        self.done = done
+        self.index = 0
+        self.start = self.timers.now()
+        self._run()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.index = len(self.reader)
+
+    def _scheduler(self, report_id):
+        schedulers = self.dispatcher.schedulers
+        if report_id not in schedulers:
+            report_id = self.fallback_id
+        return schedulers.get(report_id)
+
+    def _run(self):
+        self._timer = None
+        reader = self.reader
+        count = len(reader)
+        if count:
+            base = reader[0][0]
+        while self.index < count:
+            timestamp, report_id, report = reader[self.index]
+            if self.speed is not None:
+                due = self.start + int((timestamp - base) / self.speed)
+                if due > self.timers.now():
+                    self._timer = self.timers.call_at(due, self._run)
+                    return
+            scheduler = self._scheduler(report_id)
+            if scheduler is None:
+                self.skipped += 1
+            elif not scheduler.submit(report):
+                if not self._waiting_writable:
+                    self._waiting_writable = True
+                    scheduler.on_writable(self._on_writable)
+                return
+            self.index += 1
+        if self.done is not None:
+            done, self.done = self.done, None
+            done()
+
+    def _on_writable(self):
+        self._waiting_writable = False
+        self._run()
+
+
+def diff(path_a, path_b):
+    """比较两个录制文件的报文序列（忽略时间戳），返回第一个不同的下标，相同时返回 -1"""
+    a, b = TraceReader(path_a), TraceReader(path_b)
+    try:
+        common = min(a.count, b.count)
+        for index in range(common):
+            # 跳过 8 字节时间戳，只比较长度、Report ID 和报文
+            start = HEADER.size + index * RECORD_SIZE + 8
+            end = start + RECORD_SIZE - 8
+            if a.map[start:end] != b.map[start:end]:
+                return index
+        return -1 if a.count == b.count else common
+    finally:
+        a.close()
+        b.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输入报文录制文件工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="显示记录数和时长")
+    info.add_argument("path")
+    compare = sub.add_parser("diff", help="比较两个录制文件的报文序列")
+    compare.add_argument("a")
+    compare.add_argument("b")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        reader = TraceReader(args.path)
+        print(f"{len(reader)} 条记录，时长 {reader.duration_ns() / 1e9:.3f} 秒")
+        reader.close()
+        return 0
+    index = diff(args.a, args.b)
+    if index < 0:
+        print("相同")
+        return 0
+    print(f"第 {index} 条记录起不同")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+# scheduler.py
+import time
+from collections import deque
+
+import metrics
+import timers
+
+DEFAULT_INTERVAL_MS = 8  # 约等于 BLE 最小连接间隔 7.5ms
+DEFAULT_BURST = 1  # 每个间隔发送的报文数
+DEFAULT_CAPACITY = 4096
+DEFAULT_PENDING_CAPACITY = 256  # 未订阅期间最多缓存的报文数
+
+# 未订阅期间缓存已满时的处理方式
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_BLOCK = "block"  # 拒绝新报文，由调用方等待 on_writable
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# submit 的返回值：报文按丢弃策略被丢弃（为真值，调用方无需重试）
+DROPPED = "dropped"
+
+
+class ReportScheduler:
+    """有界报文队列：按固定节奏把报文交给 sink，保证先进先出
+
+    暂停期间（主机尚未订阅）报文留在队列中，最多 pending_capacity 个，
+    超出时按 overflow 策略处理；恢复时一次性全部发出。
+    release 为全部抬起报文：丢弃最新报文时用它收尾，避免按下保留而抬起被丢。
+    """
+
+    def __init__(
+        self,
+        sink,
+        interval_ms=DEFAULT_INTERVAL_MS,
+        burst=DEFAULT_BURST,
+        capacity=DEFAULT_CAPACITY,
+        pending_capacity=DEFAULT_PENDING_CAPACITY,
+        overflow=OVERFLOW_BLOCK,
+        paused=False,
+        dispatcher=None,
+        release=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow}")
+        self.sink = sink
+        self.interval_ms = interval_ms
+        self.burst = burst
+        self.capacity = capacity
+        self.low_watermark = capacity // 2
+        self.pending_capacity = min(pending_capacity, capacity)
+        self.overflow = overflow
+        self.paused = paused
+        self.release = release
+        self.dropped = 0
+        # 多个报文共用发送节奏时由 ReportDispatcher 驱动，不再单独计时
+        self.dispatcher = dispatcher
+        self._queue = deque()
+        self._stamps = deque()  # 与 _queue 对应的入队时间，用于统计排队延迟
+        self._feeds = deque()
+        self._writable_callbacks = []
+        self._timer = None
+        self._last_emit = 0.0
+        self.latency = metrics.histogram("report.enqueue_to_emit")
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _limit(self):
+        return self.pending_capacity if self.paused else self.capacity
+
+    def batch_limit(self):
+        """submit_many 当前一次最多能放入的报文数，超过时永远放不进"""
+        return self._limit()
+
+    def _dropping(self):
+        return self.paused and self.overflow != OVERFLOW_BLOCK
+
+    def free_slots(self):
+        if self._dropping():
+            return self.pending_capacity  # 丢弃策略下总能放入
+        return max(0, self._limit() - len(self._queue))
+
+    def _make_room(self, n):
+        """为 n 个新报文腾出空间；返回实际应放入的个数，None 表示队列已满"""
+        excess = len(self._queue) + n - self._limit()
+        if excess <= 0:
+            return n
+        if not self._dropping():
+            return None
+        if self.overflow == OVERFLOW_DROP_NEWEST:
+            keep = max(0, n - excess)
+            self.dropped += n - keep
+            return keep
+        # 丢弃最旧的：先丢队列里的，仍不够时丢新报文中靠前的
+        for _ in range(min(len(self._queue), excess)):
+            self._queue.popleft()
+            self._stamps.popleft()
+        self.dropped += excess
+        return min(n, self.pending_capacity)
+
+    def _seal(self):
+        """丢弃最新报文后，把队尾换成全部抬起报文，主机端不会留下按住的键"""
+        queue = self._queue
+        if self.release is None or not queue or queue[-1] == self.release:
+            return
+        queue[-1] = self.release
+        self.dropped += 1
+
+    def submit(self, report):
+        """放入一个报文；队列已满时返回 False，由调用方稍后重试
+
+        按丢弃策略丢掉了报文时返回 DROPPED。
+        """
+        keep = self._make_room(1)
+        if keep is None:
+            return False
+        if not keep:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self._seal()
+            return DROPPED
+        self._queue.append(report)
+        self._stamps.append(time.perf_counter_ns())
+        self._arm()
+        return True
+
+    def submit_many(self, reports):
+        """原子地放入一组报文（如按下/释放对），空间不足时一个都不放
+
+        drop-newest 策略下整组丢弃，不会只留下按下报文。
+        """
+        reports = list(reports)
+        count = len(reports)
+        keep = self._make_room(count)
+        if keep is None:
+            return False
+        if keep < count:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self.dropped += keep
+                self._seal()
+                return DROPPED
+            reports = reports[count - keep:]
+        self._queue.extend(reports)
+        self._stamps.extend([time.perf_counter_ns()] * len(reports))
+        self._arm()
+        return True if keep == count else DROPPED
+
+    def feed(self, reports, done=None):
+        """从可迭代对象中按队列空间逐步拉取报文，多个 feed 按提交顺序依次执行"""
+        self._feeds.append((iter(reports), done))
+        if len(self._feeds) == 1:
+            self._pump_feeds()
+            self._arm()
+
+    def on_writable(self, callback, slots=1):
+        """队列回落到低水位、且至少有 slots 个空位时调用一次 callback"""
+        if self._writable(slots):
+            callback()
+        else:
+            self._writable_callbacks.append((callback, slots))
+
+    def pause(self):
+        """主机取消订阅：之后的报文留在队列中等待"""
+        self.paused = True
+
+    def resume(self):
+        """主机开始订阅：缓存的报文立即一次性发出，之后恢复正常节奏"""
+        if not self.paused:
+            return
+        self.paused = False
+        if self._queue:
+            self._emit(len(self._queue))
+        elif self._feeds:
+            self._pump_feeds()
+        self._arm()
+
+    def _writable(self, slots=1):
+        if self.paused:
+            return self._dropping() or self.pending_capacity - len(self._queue) >= slots
+        return (
+            len(self._queue) <= self.low_watermark
+            and self.capacity - len(self._queue) >= slots
+        )
+
+    def clear(self):
+        self._queue.clear()
+        self._stamps.clear()
+        self._feeds.clear()
+
+    def _pump_feeds(self):
+        queue = self._queue
+        stamps = self._stamps
+        limit = self._limit()
+        dropping = self._dropping()
+        now = time.perf_counter_ns()
+        while self._feeds:
+            iterator, done = self._feeds[0]
+            for report in iterator:
+                if dropping and len(queue) >= limit:
+                    self.dropped += 1
+                    if self.overflow == OVERFLOW_DROP_NEWEST:
+                        self._seal()
+                        continue
+                    queue.popleft()
+                    stamps.popleft()
+                queue.append(report)
+                stamps.append(now)
+                if not dropping and len(queue) >= limit:
+                    return
+            self._feeds.popleft()
+            if done is not None:
+                done()
+
+    def _arm(self):
+        if self._timer is not None or self.paused or not self._queue:
+            return
+        if self.dispatcher is not None:
+            self.dispatcher.wake(self)
+            return
+        # 空闲超过一个间隔时立即发送，避免首个按键多等一个周期
+        if (time.monotonic() - self._last_emit) * 1000 >= self.interval_ms:
+            self._emit()
+            if not self._queue:
+                return
+        self._timer = timers.call_every(self.interval_ms, self._tick)
+
+    def _emit(self, count=None):
+        queue = self._queue
+        stamps = self._stamps
+        sink = self.sink
+        observe = self.latency.observe
+        for _ in range(min(count or self.burst, len(queue))):
+            sink(queue.popleft())
+            observe(time.perf_counter_ns() - stamps.popleft())
+        self._last_emit = time.monotonic()
+
+        if self._feeds:
+            self._pump_feeds()
+        if self._writable_callbacks and self._writable():
+            callbacks, self._writable_callbacks = self._writable_callbacks, []
+            for callback, slots in callbacks:
+                if self._writable(slots):
+                    callback()
+                else:
+                    self._writable_callbacks.append((callback, slots))
+
+    def _tick(self):
+        if self.paused:
+            self._timer = None
+            return False
+        self._emit()
+        if self._queue:
+            return True
+        self._timer = None
+        return False
+
+
+class ReportDispatcher:
+    """多个输入报文（不同 Report ID）共用一个发送节奏
+
+    每个报文保留自己的 ReportScheduler 队列（缓存、溢出策略和背压不变），
+    由本对象按轮询依次各取一个报文发送，负载高时各报文公平交替。
+    """
+
+    def __init__(self, interval_ms=DEFAULT_INTERVAL_MS, burst=DEFAULT_BURST):
+        self.interval_ms = interval_ms
+        self.burst = burst
+        self.schedulers = {}
+        self._ready = deque()
+        self._timer = None
+        self._last_emit = 0.0
+
+    def register(self, report_id, scheduler):
+        scheduler.dispatcher = self
+        self.schedulers[report_id] = scheduler
+        return scheduler
+
+    def submit(self, report_id, report):
+        """把报文送入对应 Report ID 的队列"""
+        return self.schedulers[report_id].submit(report)
+
+    def wake(self, scheduler):
+        if scheduler not in self._ready:
+            self._ready.append(scheduler)
+        if self._timer is not None:
+            return
+        if (time.monotonic() - self._last_emit) * 1000 >= self.interval_ms:
+            self._emit()
+        if self._ready and self._timer is None:
+            self._timer = timers.call_every(self.interval_ms, self._tick)
+
+    def _emit(self):
+        ready = self._ready
+        self._last_emit = time.monotonic()
+        sent = 0
+        while ready and sent < self.burst:
+            scheduler = ready.popleft()
+            if scheduler.paused or not len(scheduler):
+                continue
+            scheduler._emit(1)
+            sent += 1
+            if len(scheduler) and not scheduler.paused and scheduler not in ready:
+                ready.append(scheduler)
+
+    def _tick(self):
+        self._emit()
+        if self._ready:
+            return True
+        self._timer = None
+        return False
@@ -3,11 +3,18 @@ import dbus
 import dbus.exceptions
 import dbus.service
 
-from base import GattService
+from base import DEFAULT_BASE_PATH, GattService
+from scheduler import OVERFLOW_BLOCK, ReportDispatcher
 from characteristic import (
+    PROTOCOL_MODE_BOOT,
+    PROTOCOL_MODE_REPORT,
+    BootKeyboardInputReportCharacteristic,
+    BootKeyboardOutputReportCharacteristic,
+    ConsumerInputReportCharacteristic,
     HIDInformationCharacteristic,
     ControlPointCharacteristic,
     InputReportCharacteristic,
+    MouseInputReportCharacteristic,
     ProtocolModeCharacteristic,
     ReportMapCharacteristic,
 )
@@ -16,17 +23,84 @@ from characteristic import (
 class HIDService(GattService):
     HID_UUID = "1812"
 
-    def __init__(self, bus, index):
-        GattService.__init__(self, bus, index, self.HID_UUID, True)
+    def __init__(
+        self,
+        bus,
+        index,
+        base_path=DEFAULT_BASE_PATH,
+        report_mode="6kro",
+        overflow=OVERFLOW_BLOCK,
+        composite=False,
+    ):
+        GattService.__init__(self, bus, index, self.HID_UUID, True, base_path)
+        self.protocol_mode = PROTOCOL_MODE_REPORT
+        # 所有输入报文共用一个发送节奏，按轮询交替
+        self.dispatcher = ReportDispatcher()
 
         self.protocolMode = ProtocolModeCharacteristic(bus, 0, self)
         self.hidInformation = HIDInformationCharacteristic(bus, 1, self)
         self.controlPoint = ControlPointCharacteristic(bus, 2, self)
-        self.inputReport = InputReportCharacteristic(bus, 3, self)
-        self.reportMap = ReportMapCharacteristic(bus, 4,self)
+        self.inputReport = InputReportCharacteristic(
+            bus, 3, self, report_mode, overflow, self.dispatcher
+        )
+        self.reportMap = ReportMapCharacteristic(bus, 4, self, report_mode, composite)
+        self.bootInput = BootKeyboardInputReportCharacteristic(
+            bus, 5, self, self.inputReport.report_pool
+        )
+        self.bootOutput = BootKeyboardOutputReportCharacteristic(bus, 6, self)
 
         self.add_characteristic(self.protocolMode)
         self.add_characteristic(self.hidInformation)
         self.add_characteristic(self.controlPoint)
         self.add_characteristic(self.inputReport)
         self.add_characteristic(self.reportMap)
+        self.add_characteristic(self.bootInput)
+        self.add_characteristic(self.bootOutput)
+
+        # 组合设备：多媒体键和鼠标各一个输入报文特征值
+        self.consumerReport = self.mouseReport = None
+        self.extra_reports = []
+        if composite:
+            self.consumerReport = ConsumerInputReportCharacteristic(
+                bus, 7, self, overflow, self.dispatcher
+            )
+            self.mouseReport = MouseInputReportCharacteristic(
+                bus, 8, self, overflow, self.dispatcher
+            )
+            self.extra_reports = [self.consumerReport, self.mouseReport]
+            for char in self.extra_reports:
+                self.add_characteristic(char)
+
+    def active_input_report(self):
+        if self.protocol_mode == PROTOCOL_MODE_BOOT:
+            return self.bootInput
+        return self.inputReport
+
+    def set_protocol_mode(self, mode):
+        """主机切换协议模式：Boot 模式下同一个调度器改为发往 Boot 输入报文"""
+        self.protocol_mode = mode
+        scheduler = self.inputReport.scheduler
+        if mode == PROTOCOL_MODE_BOOT:
+            scheduler.sink = self.bootInput.send_boot_report
+        else:
+            scheduler.sink = self.inputReport.send_key_report
+        self._update_delivery()
+
+    def report_notify_changed(self, char):
+        if char is self.active_input_report() or char in self.extra_reports:
+            self._update_delivery()
+
+    def _update_delivery(self):
+        """输入报文未订阅时暂停对应调度器，报文缓存到订阅后一次发出
+
+        Boot 模式下只有 Boot 键盘报文，多媒体键和鼠标报文一律缓存。
+        """
+        deliveries = [(self.inputReport.scheduler, self.active_input_report().notifying)]
+        boot = self.protocol_mode == PROTOCOL_MODE_BOOT
+        for char in self.extra_reports:
+            deliveries.append((char.scheduler, char.notifying and not boot))
+        for scheduler, notifying in deliveries:
+            if notifying:
+                scheduler.resume()
+            else:
+                scheduler.pause()
@@ -0,0 +1,258 @@
+# shmring.py
+"""共享内存报文环：生产者进程生成报文，D-Bus 进程负责发送
+
+每个生产者进程独占一个单生产者/单消费者环（multiprocessing.shared_memory），
+无需加锁：生产者只写 tail，消费者只写 head，两者各占一个缓存行。
+所有环共用一个数据报套接字对作为唤醒通道，生产者每发布一批写入一个字节，
+D-Bus 进程中的 GLib 监听被唤醒后依次排空各环，送入 InputReportCharacteristic
+的发送队列；队列已满时停止读取，报文留在环中，生产者随之阻塞（背压）。
+"""
+import importlib
+import logging
+import socket
+import time
+from multiprocessing import shared_memory
+
+from gi.repository import GLib
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 1024  # 每个环的槽位数，必须是 2 的幂
+DEFAULT_PRODUCER = "shmring:periodic_producer"
+RETRY_SLEEP = 0.002  # 环已满时生产者的等待间隔（秒）
+
+# 头部按 8 字节整数索引：head、tail 各占一个 64 字节缓存行
+_HEAD = 0
+_TAIL = 8
+_CAPACITY = 16
+_SLOT_SIZE = 17
+HEADER_SIZE = 192
+
+
+class ReportRing:
+    """定长报文的单生产者/单消费者环形缓冲区"""
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self._header = shm.buf[:HEADER_SIZE]
+        self._index = self._header.cast("Q")
+        self.capacity = self._index[_CAPACITY]
+        self.slot_size = self._index[_SLOT_SIZE]
+        self._mask = self.capacity - 1
+        self._slots = shm.buf[HEADER_SIZE:HEADER_SIZE + self.capacity * self.slot_size]
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY, slot_size=8):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError(f"环容量必须是 2 的幂: {capacity}")
+        shm = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + capacity * slot_size
+        )
+        with shm.buf[:HEADER_SIZE] as header, header.cast("Q") as index:
+            index[_HEAD] = index[_TAIL] = 0
+            index[_CAPACITY] = capacity
+            index[_SLOT_SIZE] = slot_size
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return self._index[_TAIL] - self._index[_HEAD]
+
+    def put_many(self, reports):
+        """生产者：写入尽可能多的报文并一次性发布，返回写入个数"""
+        index = self._index
+        tail = index[_TAIL]
+        free = self.capacity - (tail - index[_HEAD])
+        size = self.slot_size
+        slots = self._slots
+        mask = self._mask
+        written = 0
+        for report in reports:
+            if written >= free:
+                break
+            if len(report) != size:
+                raise ValueError(f"报文长度应为 {size} 字节: {len(report)}")
+            offset = ((tail + written) & mask) * size
+            slots[offset:offset + size] = report
+            written += 1
+        if written:
+            # 先写槽位再推进 tail，消费者看到新 tail 时数据已就绪
+            index[_TAIL] = tail + written
+        return written
+
+    def get_many(self, limit):
+        """消费者：取出至多 limit 个报文"""
+        index = self._index
+        head = index[_HEAD]
+        count = min(limit, index[_TAIL] - head)
+        if count <= 0:
+            return []
+        size = self.slot_size
+        slots = self._slots
+        mask = self._mask
+        reports = []
+        for i in range(head, head + count):
+            offset = (i & mask) * size
+            reports.append(bytes(slots[offset:offset + size]))
+        index[_HEAD] = head + count
+        return reports
+
+    def close(self):
+        self._slots.release()
+        self._index.release()
+        self._header.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingProducer:
+    """生产者进程一侧：写入自己的环并唤醒 D-Bus 进程"""
+
+    def __init__(self, ring, wakeup):
+        self.ring = ring
+        self.wakeup = wakeup
+        self.slot_size = ring.slot_size
+
+    def send_many(self, reports, block=True):
+        """发送一批报文；block 时环满则等待消费者腾出空间，返回写入个数"""
+        reports = list(reports)
+        sent = 0
+        while True:
+            n = self.ring.put_many(reports[sent:])
+            if n:
+                sent += n
+                self._wake()
+            if sent >= len(reports) or not block:
+                return sent
+            time.sleep(RETRY_SLEEP)
+
+    def send(self, report, block=True):
+        return self.send_many((report,), block) == 1
+
+    def _wake(self):
+        try:
+            self.wakeup.send(b"\0")
+        except BlockingIOError:
+            pass  # 套接字缓冲区已满：已有唤醒尚未处理
+
+
+class RingConsumer:
+    """D-Bus 进程一侧：每个生产者一个环，共用一个唤醒监听，排空到 char 的发送队列"""
+
+    def __init__(self, char, producers=1, capacity=DEFAULT_CAPACITY):
+        self.char = char
+        slot_size = char.report_pool.REPORT_SIZE
+        self.rings = [ReportRing.create(capacity, slot_size) for _ in range(producers)]
+        self._wakeup_recv, self.wakeup = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._wakeup_recv.setblocking(False)
+        self.wakeup.setblocking(False)
+        self.processes = []
+        self._next = 0
+        self._waiting_writable = False
+        self._watch = GLib.io_add_watch(
+            self._wakeup_recv.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_wakeup
+        )
+
+    def _on_wakeup(self, fd, condition):
+        metrics.incr("shmring.wakeups")
+        while True:
+            try:
+                self._wakeup_recv.recv(64)
+            except BlockingIOError:
+                break
+        if not self._waiting_writable:
+            self._drain()
+        return True
+
+    def _drain(self):
+        scheduler = self.char.scheduler
+        intern = self.char.report_pool.intern
+        rings = self.rings
+        # 轮流从不同的环开始，队列紧张时各生产者公平
+        start = self._next
+        self._next = (start + 1) % len(rings)
+        for i in range(len(rings)):
+            ring = rings[(start + i) % len(rings)]
+            free = scheduler.free_slots()
+            if not free:
+                break
+            reports = ring.get_many(free)
+            if reports:
+                scheduler.submit_many([intern(report) for report in reports])
+                metrics.incr("shmring.reports", len(reports))
+        if any(len(ring) for ring in rings):
+            # 发送队列已满：报文留在环中，等队列回落后继续
+            self._waiting_writable = True
+            scheduler.on_writable(self._on_writable)
+
+    def _on_writable(self):
+        self._waiting_writable = False
+        self._drain()
+
+    def start_producers(self, target=DEFAULT_PRODUCER, *args):
+        """为每个环启动一个生产者进程，运行 target(producer, index, *args)
+
+        target 为 "模块:函数"，在子进程中导入。
+        """
+        import multiprocessing
+
+        ctx = multiprocessing.get_context("spawn")
+        for i, ring in enumerate(self.rings):
+            proc = ctx.Process(
+                target=run_producer,
+                args=(target, ring.name, self.wakeup, i, args),
+                name=f"report-producer-{i}",
+                daemon=True,
+            )
+            proc.start()
+            self.processes.append(proc)
+        logger.info("🏭 已启动 %d 个报文生产者进程: %s", len(self.processes), target)
+
+    def close(self):
+        for proc in self.processes:
+            proc.terminate()
+        for proc in self.processes:
+            proc.join()
+        GLib.source_remove(self._watch)
+        self._wakeup_recv.close()
+        self.wakeup.close()
+        for ring in self.rings:
+            ring.close()
+
+
+def _resolve(target):
+    module, _, func = target.partition(":")
+    return getattr(importlib.import_module(module), func)
+
+
+def run_producer(target, ring_name, wakeup, index, args):
+    """生产者进程入口"""
+    ring = ReportRing.attach(ring_name)
+    try:
+        _resolve(target)(RingProducer(ring, wakeup), index, *args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+def periodic_producer(producer, index, report_mode="6kro", interval=5.0):
+    """示例生产者：每隔 interval 秒按一次 A 键（与周期性测试按键相同）"""
+    from report import REPORT_POOLS
+
+    pool = REPORT_POOLS[report_mode]
+    reports = (pool.encode(0, [0x04]), pool.release)  # A键
+    while True:
+        time.sleep(interval)
+        producer.send_many(reports)
@@ -0,0 +1,110 @@
+# tests/test_evdev_bridge.py
+"""EvdevBridge：经管道写入 input_event，检查生成的报文、SYN_DROPPED 和 EOF 处理"""
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from gi.repository import GLib
+except ImportError:  # pragma: no cover
+    raise unittest.SkipTest("需要 PyGObject")
+
+from evdev_bridge import EV_KEY, EV_SYN, EVENT_SIZE, SYN_DROPPED, SYN_REPORT, EvdevBridge
+from keystate import KeyState
+from report import KEY_DOWN, KEY_RELEASE, REPORT_POOL
+from scheduler import ReportScheduler
+
+KEY_A = 30  # Usage 0x04
+KEY_B = 48  # Usage 0x05
+KEY_LEFTSHIFT = 42  # Usage 0xE1
+
+
+def event(etype, code, value=0):
+    return struct.pack("llHHi", 0, 0, etype, code, value)
+
+
+SYN = event(EV_SYN, SYN_REPORT)
+
+
+class _Dispatcher:
+    def wake(self, scheduler):
+        pass
+
+
+class _Char:
+    """EvdevBridge 只用到 key_state、report_mode 和 scheduler"""
+
+    report_pool = REPORT_POOL
+    report_mode = "6kro"
+
+    def __init__(self):
+        self.scheduler = ReportScheduler(
+            lambda report: None, dispatcher=_Dispatcher(), release=REPORT_POOL.release
+        )
+        self.key_state = KeyState(self)
+
+    def queue_report(self, report):
+        return self.scheduler.submit(report)
+
+
+class EvdevBridgeTest(unittest.TestCase):
+    def setUp(self):
+        self.assertEqual(len(SYN), EVENT_SIZE)
+        self.read_fd, self.write_fd = os.pipe()
+        self.char = _Char()
+        self.bridge = EvdevBridge(self.char, self.read_fd)
+
+    def tearDown(self):
+        self.bridge.close()
+        os.close(self.read_fd)
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+
+    def feed(self, *events):
+        os.write(self.write_fd, b"".join(events))
+        return self.bridge._on_readable(self.read_fd, GLib.IO_IN)
+
+    def reports(self):
+        return list(self.char.scheduler._queue)
+
+    def test_frames_become_reports(self):
+        self.assertTrue(self.feed(
+            event(EV_KEY, KEY_LEFTSHIFT, 1), event(EV_KEY, KEY_A, 1), SYN,
+            event(EV_KEY, KEY_A, 2), SYN,  # 自动重复交给主机
+            event(EV_KEY, KEY_A, 0), event(EV_KEY, KEY_LEFTSHIFT, 0), SYN,
+        ))
+        self.assertEqual(
+            self.reports(),
+            [bytes([0x02, 0, 0x04, 0, 0, 0, 0, 0]), KEY_RELEASE],
+        )
+
+    def test_partial_frame_waits_for_syn(self):
+        self.feed(event(EV_KEY, KEY_A, 1))
+        self.assertEqual(self.reports(), [])
+        self.assertEqual(self.char.key_state.keys, [])
+        self.feed(SYN)
+        self.assertEqual(self.reports(), [KEY_DOWN[0x04]])
+
+    def test_syn_dropped_resyncs(self):
+        self.feed(event(EV_KEY, KEY_A, 1), SYN)
+        # 溢出后丢弃到下一帧；管道不支持 EVIOCGKEY，按全部抬起重建
+        self.feed(event(EV_SYN, SYN_DROPPED), event(EV_KEY, KEY_B, 1), SYN)
+        self.assertEqual(self.reports(), [KEY_DOWN[0x04], KEY_RELEASE])
+        self.feed(event(EV_KEY, KEY_B, 1), SYN)
+        self.assertEqual(self.reports()[-1], KEY_DOWN[0x05])
+
+    def test_eof_releases_all(self):
+        self.feed(event(EV_KEY, KEY_A, 1), event(EV_KEY, KEY_B, 1), SYN)
+        os.close(self.write_fd)
+        self.write_fd = None
+        self.assertFalse(self.bridge._on_readable(self.read_fd, GLib.IO_HUP))
+        self.assertIsNone(self.bridge.fd)
+        self.char.key_state.flush()
+        self.assertEqual(self.reports()[-1], KEY_RELEASE)
+
+
+if __name__ == "__main__":
+    unittest.main()
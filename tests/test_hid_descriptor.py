@@ -0,0 +1,174 @@
+# tests/test_hid_descriptor.py
+"""报告描述符：DescriptorBuilder 与 parse 往返一致，各报文编码后可解码并通过批量校验"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import dbus  # noqa: F401  report 需要 dbus
+except ImportError:  # pragma: no cover
+    raise unittest.SkipTest("需要 dbus-python")
+
+from hid_descriptor import DescriptorBuilder, ReportDecoder, parse
+from keymap import key_usage_max
+from report import (
+    BOOT_KEY_USAGE_MAX,
+    CONSUMER_REPORT_POOL,
+    MOUSE_REPORT_POOL,
+    NKRO_BITMAP_BYTES,
+    NKRO_REPORT_POOL,
+    REPORT_POOL,
+)
+from report_maps import (
+    COMPOSITE_REPORT_MAPS,
+    KEYBOARD_6KRO,
+    KEYBOARD_6KRO_LAYOUT,
+    KEYBOARD_NKRO,
+    KEYBOARD_NKRO_LAYOUT,
+    REPORT_ID_CONSUMER,
+    REPORT_ID_KEYBOARD,
+    REPORT_ID_MOUSE,
+    composite,
+)
+
+KEYBOARD_POOLS = {"6kro": REPORT_POOL, "nkro": NKRO_REPORT_POOL}
+
+
+def _fields(layout):
+    """布局中与字段名无关的全部属性"""
+    return {
+        key: [
+            (f.bit_offset, f.size, f.count, f.flags, f.usage_page, f.usages,
+             f.usage_min, f.usage_max, f.logical_min, f.logical_max)
+            for f in report.fields
+        ]
+        for key, report in layout.reports.items()
+    }
+
+
+def _keys(mode, decoded):
+    if mode == "nkro":
+        return [usage for usage, bit in enumerate(decoded["keys"]) if bit]
+    return decoded["keys"]
+
+
+class RoundTripTest(unittest.TestCase):
+    def check_keyboard(self, mode, layout):
+        pool = KEYBOARD_POOLS[mode]
+        decoder = ReportDecoder(layout)
+        self.assertEqual(decoder.size, pool.REPORT_SIZE)
+        reports = [pool.release, pool.encode(0x02, [0x04, 0x05]), pool.encode(0x81, [0x65])]
+        for report in reports:
+            decoded = decoder.decode(report)
+            self.assertEqual(
+                sum(bit << i for i, bit in enumerate(decoded["modifiers"])), report[0]
+            )
+        self.assertEqual(_keys(mode, decoder.decode(reports[1])), [0x04, 0x05])
+        self.assertEqual(decoder.validate_batch(b"".join(reports)), -1)
+
+    def test_keyboard_maps(self):
+        for mode, data, built in (
+            ("6kro", KEYBOARD_6KRO, KEYBOARD_6KRO_LAYOUT),
+            ("nkro", KEYBOARD_NKRO, KEYBOARD_NKRO_LAYOUT),
+        ):
+            with self.subTest(mode=mode):
+                self.assertEqual(_fields(parse(data)), _fields(built))
+                self.check_keyboard(mode, built.input())
+
+    def test_composite_maps(self):
+        for mode, data in COMPOSITE_REPORT_MAPS.items():
+            with self.subTest(mode=mode):
+                built_data, built = composite(mode)
+                self.assertEqual(built_data, data)
+                self.assertEqual(_fields(parse(data)), _fields(built))
+                self.check_keyboard(mode, built.input(REPORT_ID_KEYBOARD))
+
+                consumer = ReportDecoder(built.input(REPORT_ID_CONSUMER))
+                report = CONSUMER_REPORT_POOL.encode(0xE9)
+                self.assertEqual(consumer.decode(report), {"consumer": [0xE9]})
+                self.assertEqual(consumer.validate_batch(report + CONSUMER_REPORT_POOL.release), -1)
+
+                mouse = ReportDecoder(built.input(REPORT_ID_MOUSE))
+                reports = MOUSE_REPORT_POOL.encode_motion(0x01, 300, -5, -127)
+                self.assertEqual(
+                    [mouse.decode(r)["axes"] for r in reports],
+                    [[127, -5, -127], [127, 0, 0], [46, 0, 0]],
+                )
+                self.assertEqual(mouse.decode(reports[0])["buttons"], [1, 0, 0, 0, 0])
+                self.assertEqual(mouse.validate_batch(b"".join(reports)), -1)
+
+
+class ValidateTest(unittest.TestCase):
+    def setUp(self):
+        self.layout = composite("6kro")[1]
+
+    def test_key_array_range(self):
+        decoder = ReportDecoder(self.layout.input(REPORT_ID_KEYBOARD))
+        bad = bytes([0, 0, 0x66, 0, 0, 0, 0, 0])
+        self.assertEqual(decoder.validate_batch(REPORT_POOL.release + bad), 1)
+
+    def test_reserved_byte_must_be_zero(self):
+        decoder = ReportDecoder(self.layout.input(REPORT_ID_KEYBOARD))
+        self.assertEqual(decoder.validate_batch(bytes([0, 1, 0, 0, 0, 0, 0, 0])), 0)
+
+    def test_signed_axis_range(self):
+        decoder = ReportDecoder(self.layout.input(REPORT_ID_MOUSE))
+        # -128 低于逻辑最小值 -127
+        self.assertEqual(decoder.validate_batch(bytes([0, 1, 2, 3, 0, 0x80, 0, 0])), 1)
+
+    def test_16bit_array_range(self):
+        decoder = ReportDecoder(self.layout.input(REPORT_ID_CONSUMER))
+        self.assertEqual(decoder.validate_batch(b"\xe9\x00\xff\x03\x00\x04"), 2)
+
+    def test_length_must_be_multiple(self):
+        decoder = ReportDecoder(self.layout.input(REPORT_ID_MOUSE))
+        with self.assertRaises(ValueError):
+            decoder.validate_batch(bytes(5))
+
+
+class BootReportTest(unittest.TestCase):
+    def test_boot_limit_matches_6kro_map(self):
+        self.assertEqual(key_usage_max(KEYBOARD_6KRO), BOOT_KEY_USAGE_MAX)
+
+    def test_nkro_to_boot_drops_unrepresentable_keys(self):
+        decoder = ReportDecoder(KEYBOARD_6KRO_LAYOUT.input())
+        boot = NKRO_REPORT_POOL.to_boot(NKRO_REPORT_POOL.encode(0x02, [0x04, 0x70, 0x7F]))
+        self.assertEqual(boot, REPORT_POOL.encode(0x02, [0x04]))
+        self.assertEqual(decoder.validate_batch(boot), -1)
+
+
+class BuilderTest(unittest.TestCase):
+    def test_item_sizes(self):
+        data, _ = (
+            DescriptorBuilder()
+            .logical_range(-127, 127)
+            .logical_max(0x3FF)
+            .report_size(8)
+            .build()
+        )
+        self.assertEqual(data, bytes([0x15, 0x81, 0x25, 0x7F, 0x26, 0xFF, 0x03, 0x75, 0x08]))
+
+    def test_unsigned_logical_max(self):
+        data, layout = (
+            DescriptorBuilder()
+            .logical_range(0, 0xFF).report_size(8).report_count(1)
+            .input(0x00, "value")
+            .build()
+        )
+        self.assertEqual(layout.input().field("value").logical_max, 0xFF)
+        self.assertEqual(parse(data).input().fields[0].logical_max, 0xFF)
+
+    def test_collection_balance(self):
+        with self.assertRaises(ValueError):
+            DescriptorBuilder().collection().build()
+        with self.assertRaises(ValueError):
+            DescriptorBuilder().end_collection()
+
+    def test_bitmap_size(self):
+        self.assertEqual(KEYBOARD_NKRO_LAYOUT.input().size, 1 + NKRO_BITMAP_BYTES)
+
+
+if __name__ == "__main__":
+    unittest.main()
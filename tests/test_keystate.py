@@ -0,0 +1,103 @@
+# tests/test_keystate.py
+"""KeyState：同一轮事件的合并、队列已满时的中间状态补发和 drop-newest 丢弃"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from gi.repository import GLib
+except ImportError:  # pragma: no cover
+    raise unittest.SkipTest("需要 PyGObject")
+
+from keystate import KeyState
+from report import KEY_DOWN, KEY_RELEASE, REPORT_POOL
+from scheduler import OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, ReportScheduler
+
+FILLER = b"filler"
+
+
+class _Dispatcher:
+    def wake(self, scheduler):
+        pass
+
+
+class _Char:
+    report_pool = REPORT_POOL
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        self.scheduler = ReportScheduler(
+            self.sent.append, dispatcher=_Dispatcher(), release=REPORT_POOL.release, **kwargs
+        )
+        self.key_state = KeyState(self)
+
+    def queue_report(self, report):
+        return self.scheduler.submit(report)
+
+
+class KeyStateTest(unittest.TestCase):
+    def tearDown(self):
+        source = self.char.key_state._flush_source
+        if source is not None:
+            GLib.source_remove(source)
+
+    def test_same_round_is_coalesced(self):
+        self.char = _Char()
+        key_state = self.char.key_state
+        key_state.press(0xE1)
+        key_state.press(0x04)
+        self.assertTrue(key_state.flush())
+        self.assertTrue(key_state.flush())  # 状态未变，不重复发送
+        self.assertEqual(list(self.char.scheduler._queue), [REPORT_POOL.encode(0x02, [0x04])])
+        self.assertEqual(key_state.suppressed, 1)
+
+    def test_tap_survives_full_queue(self):
+        self.char = _Char(capacity=4)
+        scheduler = self.char.scheduler
+        for _ in range(4):
+            scheduler.submit(FILLER)
+        key_state = self.char.key_state
+        key_state.tap(0x04)
+        key_state.tap(0x04)
+        self.assertFalse(key_state.flush())
+        scheduler._emit(4)  # 回落后补发记下的中间状态
+        scheduler._emit(4)
+        scheduler._emit(4)
+        self.assertEqual(
+            self.char.sent[4:], [KEY_DOWN[0x04], KEY_RELEASE, KEY_DOWN[0x04], KEY_RELEASE]
+        )
+        self.assertEqual(len(key_state._pending), 0)
+
+    def test_dropped_report_records_release(self):
+        self.char = _Char(paused=True, pending_capacity=2, overflow=OVERFLOW_DROP_NEWEST)
+        key_state = self.char.key_state
+        key_state.press(0x04)
+        key_state.flush()
+        key_state.press(0x05)
+        key_state.flush()
+        key_state.press(0x06)
+        self.assertTrue(key_state.flush())  # 被丢弃，队尾换成全部抬起
+        self.assertEqual(list(self.char.scheduler._queue), [KEY_DOWN[0x04], KEY_RELEASE])
+        # 之后的状态变化按主机看到的全部抬起重新发送
+        key_state.release(0x06)
+        self.char.scheduler.resume()
+        key_state.flush()
+        self.assertEqual(self.char.sent, [KEY_DOWN[0x04], KEY_RELEASE])
+        self.assertEqual(list(self.char.scheduler._queue), [REPORT_POOL.encode(0, [0x04, 0x05])])
+
+    def test_block_policy_waits(self):
+        self.char = _Char(paused=True, pending_capacity=1, overflow=OVERFLOW_BLOCK)
+        key_state = self.char.key_state
+        key_state.press(0x04)
+        self.assertTrue(key_state.flush())
+        key_state.press(0x05)
+        self.assertFalse(key_state.flush())
+        self.char.scheduler.resume()  # 发出缓存后回调补发当前状态
+        self.assertEqual(self.char.sent, [KEY_DOWN[0x04]])
+        self.assertEqual(list(self.char.scheduler._queue), [REPORT_POOL.encode(0, [0x04, 0x05])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# tests/test_notify.py
+"""AcquireNotify 的 fd 通知：写入 socket、回退到信号、对端关闭后取消订阅"""
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import dbus
+    from gi.repository import GLib
+except ImportError:  # pragma: no cover
+    raise unittest.SkipTest("需要 dbus-python 和 PyGObject")
+
+from characteristic import ReportCharacteristic
+from report import KEY_DOWN, KEY_RELEASE, REPORT_POOL
+
+DEVICE = "/org/bluez/hci0/dev_00_11_22_33_44_55"
+
+
+class _Service:
+    """ReportCharacteristic 只用到服务的路径和订阅变化回调"""
+
+    def get_path(self):
+        return dbus.ObjectPath("/test/service0")
+
+    def get_application(self):
+        return None
+
+    def report_notify_changed(self, char):
+        pass
+
+
+class AcquireNotifyTest(unittest.TestCase):
+    def setUp(self):
+        self.char = ReportCharacteristic(None, 0, "2A4D", _Service(), REPORT_POOL)
+        self.signals = []
+        self.char.PropertiesChanged = lambda *args: self.signals.append(args)
+        fd, mtu = self.char.AcquireNotify({"device": DEVICE, "mtu": dbus.UInt16(64)})
+        self.assertEqual(mtu, 64)
+        self.remote = socket.socket(fileno=fd.take())
+        self.remote.setblocking(False)
+
+    def tearDown(self):
+        self.remote.close()
+        self.char.unsubscribe(DEVICE)
+
+    def test_report_written_to_acquired_fd(self):
+        self.assertTrue(self.char.notify_acquired)
+        self.char.send_key_report(KEY_DOWN[0x04])
+        self.assertEqual(self.remote.recv(64), KEY_DOWN[0x04])
+        self.assertEqual(self.signals, [])
+
+    def test_full_socket_falls_back_to_signal(self):
+        local = self.char.subscribers[DEVICE].sock
+        with self.assertRaises(BlockingIOError):
+            while True:
+                local.send(KEY_RELEASE)
+        self.char.send_key_report(KEY_DOWN[0x05])
+        self.assertEqual(len(self.signals), 1)
+        # 缓冲区满只影响本条报文，订阅仍然走 fd
+        self.assertIsNotNone(self.char.subscribers[DEVICE].sock)
+
+    def test_write_error_switches_to_signal(self):
+        self.char.subscribers[DEVICE].sock.shutdown(socket.SHUT_WR)
+        self.char.send_key_report(KEY_DOWN[0x06])
+        self.assertEqual(len(self.signals), 1)
+        self.assertIsNone(self.char.subscribers[DEVICE].sock)
+        self.assertFalse(self.char.notify_acquired)
+
+    def test_unsubscribed_device_is_not_broadcast(self):
+        other = "/org/bluez/hci0/dev_66_77_88_99_AA_BB"
+        self.assertFalse(self.char.send_key_report(KEY_DOWN[0x07], device=other))
+        self.assertEqual(self.signals, [])
+        self.assertTrue(self.char.send_key_report(KEY_DOWN[0x07], device=DEVICE))
+        self.assertEqual(self.remote.recv(64), KEY_DOWN[0x07])
+
+    def test_hup_unsubscribes(self):
+        self.remote.close()
+        context = GLib.MainContext.default()
+        while context.iteration(False):
+            pass
+        self.assertNotIn(DEVICE, self.char.subscribers)
+        self.assertFalse(self.char.notifying)
+
+
+if __name__ == "__main__":
+    unittest.main()
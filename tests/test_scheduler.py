@@ -0,0 +1,188 @@
+# tests/test_scheduler.py
+"""ReportScheduler / ReportDispatcher：容量与背压、on_writable 阈值、暂停恢复、轮询和溢出策略"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from gi.repository import GLib  # noqa: F401  timers 需要 GLib
+except ImportError:  # pragma: no cover
+    raise unittest.SkipTest("需要 PyGObject")
+
+from scheduler import (
+    DROPPED,
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    ReportDispatcher,
+    ReportScheduler,
+)
+
+RELEASE = b"\x00"
+A_DOWN, B_DOWN, C_DOWN = b"a", b"b", b"c"
+
+
+class _ManualDispatcher:
+    """不计时的调度器：由测试调用 _emit 决定何时发送"""
+
+    def wake(self, scheduler):
+        pass
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault("dispatcher", _ManualDispatcher())
+        return ReportScheduler(self.sent.append, release=RELEASE, **kwargs)
+
+    def test_capacity_backpressure(self):
+        scheduler = self.scheduler(capacity=4)
+        for i in range(4):
+            self.assertTrue(scheduler.submit(bytes([i])))
+        self.assertFalse(scheduler.submit(b"x"))
+        self.assertFalse(scheduler.submit_many([b"x", b"y"]))
+        self.assertEqual(scheduler.free_slots(), 0)
+        scheduler._emit(1)
+        self.assertTrue(scheduler.submit(b"x"))
+        self.assertEqual(len(scheduler), 4)
+
+    def test_on_writable_waits_for_slots(self):
+        scheduler = self.scheduler(capacity=8)  # 低水位 4
+        for i in range(8):
+            scheduler.submit(bytes([i]))
+        calls = []
+        scheduler.on_writable(lambda: calls.append(len(scheduler)), slots=5)
+        scheduler._emit(4)  # 回落到低水位，但只有 4 个空位
+        self.assertEqual(calls, [])
+        scheduler._emit(1)
+        self.assertEqual(calls, [3])
+        scheduler._emit(1)
+        self.assertEqual(calls, [3])  # 只调用一次
+
+    def test_on_writable_immediate_when_room(self):
+        scheduler = self.scheduler(capacity=8)
+        calls = []
+        scheduler.on_writable(lambda: calls.append(True), slots=8)
+        self.assertEqual(calls, [True])
+
+    def test_paused_slots_use_pending_capacity(self):
+        scheduler = self.scheduler(paused=True, pending_capacity=4)
+        scheduler.submit_many([A_DOWN, RELEASE])
+        calls = []
+        scheduler.on_writable(lambda: calls.append(True), slots=3)
+        self.assertEqual(calls, [])
+        scheduler.on_writable(lambda: calls.append(True), slots=2)
+        self.assertEqual(calls, [True])
+
+    def test_resume_flushes_in_order(self):
+        scheduler = self.scheduler(paused=True)
+        scheduler.submit(A_DOWN)
+        scheduler.submit_many([RELEASE, B_DOWN])
+        scheduler.feed([RELEASE, C_DOWN])
+        self.assertEqual(self.sent, [])
+        scheduler.resume()
+        self.assertEqual(self.sent, [A_DOWN, RELEASE, B_DOWN, RELEASE, C_DOWN])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_feed_waits_for_room(self):
+        scheduler = self.scheduler(capacity=2)
+        done = []
+        scheduler.feed([A_DOWN, RELEASE, B_DOWN, RELEASE], lambda: done.append(True))
+        self.assertEqual(len(scheduler), 2)
+        scheduler._emit(2)
+        self.assertEqual(len(scheduler), 2)
+        self.assertEqual(done, [])
+        scheduler._emit(2)
+        self.assertEqual(self.sent, [A_DOWN, RELEASE, B_DOWN, RELEASE])
+        self.assertEqual(done, [True])
+
+
+class OverflowTest(unittest.TestCase):
+    def scheduler(self, overflow):
+        return ReportScheduler(
+            lambda report: None, paused=True, pending_capacity=3,
+            overflow=overflow, release=RELEASE,
+        )
+
+    def test_block_rejects(self):
+        scheduler = self.scheduler(OVERFLOW_BLOCK)
+        for report in (A_DOWN, RELEASE, B_DOWN):
+            self.assertTrue(scheduler.submit(report))
+        self.assertFalse(scheduler.submit(RELEASE))
+        self.assertEqual(list(scheduler._queue), [A_DOWN, RELEASE, B_DOWN])
+        self.assertEqual(scheduler.dropped, 0)
+
+    def test_drop_oldest_keeps_latest(self):
+        scheduler = self.scheduler(OVERFLOW_DROP_OLDEST)
+        for i in range(5):
+            self.assertTrue(scheduler.submit(bytes([i + 1])))
+        self.assertEqual(list(scheduler._queue), [b"\x03", b"\x04", b"\x05"])
+        self.assertEqual(scheduler.dropped, 2)
+
+    def test_drop_newest_ends_with_release(self):
+        scheduler = self.scheduler(OVERFLOW_DROP_NEWEST)
+        for report in (A_DOWN, RELEASE, B_DOWN):
+            self.assertIs(scheduler.submit(report), True)
+        # 丢掉 B 的抬起时不能留下按住的 B
+        self.assertIs(scheduler.submit(RELEASE), DROPPED)
+        self.assertEqual(list(scheduler._queue), [A_DOWN, RELEASE, RELEASE])
+
+    def test_drop_newest_feed(self):
+        scheduler = self.scheduler(OVERFLOW_DROP_NEWEST)
+        scheduler.feed([A_DOWN, RELEASE, B_DOWN, RELEASE, C_DOWN, RELEASE])
+        self.assertEqual(list(scheduler._queue), [A_DOWN, RELEASE, RELEASE])
+        self.assertEqual(scheduler.dropped, 4)
+
+    def test_drop_newest_batch_is_atomic(self):
+        scheduler = self.scheduler(OVERFLOW_DROP_NEWEST)
+        scheduler.submit_many([A_DOWN, RELEASE])
+        self.assertIs(scheduler.submit_many([B_DOWN, RELEASE]), DROPPED)
+        self.assertEqual(list(scheduler._queue), [A_DOWN, RELEASE])
+
+
+class DispatcherTest(unittest.TestCase):
+    def test_round_robin(self):
+        sent = []
+        dispatcher = ReportDispatcher(interval_ms=60_000)
+        dispatcher._last_emit = time.monotonic()  # 不在 wake 中立即发送
+        keyboard = dispatcher.register(1, ReportScheduler(sent.append))
+        mouse = dispatcher.register(3, ReportScheduler(sent.append))
+        try:
+            for i in range(3):
+                keyboard.submit(b"k%d" % i)
+            for i in range(2):
+                mouse.submit(b"m%d" % i)
+            while dispatcher._ready:
+                dispatcher._emit()
+        finally:
+            if dispatcher._timer is not None:
+                dispatcher._timer.cancel()
+        self.assertEqual(sent, [b"k0", b"m0", b"k1", b"m1", b"k2"])
+
+    def test_paused_scheduler_is_skipped(self):
+        sent = []
+        dispatcher = ReportDispatcher(interval_ms=60_000)
+        dispatcher._last_emit = time.monotonic()
+        keyboard = dispatcher.register(1, ReportScheduler(sent.append))
+        mouse = dispatcher.register(3, ReportScheduler(sent.append))
+        try:
+            keyboard.submit(b"k0")
+            mouse.submit(b"m0")
+            mouse.pause()
+            keyboard.submit(b"k1")
+            while dispatcher._ready:
+                dispatcher._emit()
+        finally:
+            if dispatcher._timer is not None:
+                dispatcher._timer.cancel()
+        self.assertEqual(sent, [b"k0", b"k1"])
+        self.assertEqual(len(mouse), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
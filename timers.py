@@ -0,0 +1,129 @@
+# timers.py
+"""单一 GLib 定时源驱动的定时器堆（单调时钟，纳秒）
+
+进程内所有键盘的按下/抬起/重复、报文调度节奏和宏回放都挂在同一个堆上，
+主循环里任何时刻最多只有一个定时源；每次触发的迟到时间记录在
+metrics 直方图 "timer.lateness" 中，用于观察调度抖动。
+"""
+import heapq
+import itertools
+import logging
+import time
+
+from gi.repository import GLib
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+now = time.monotonic_ns
+
+_NS_PER_MS = 1_000_000
+
+
+class Timer:
+    """定时器句柄；callback 返回 True 的周期定时器会继续触发"""
+
+    __slots__ = ("deadline", "seq", "interval", "callback", "args", "cancelled")
+
+    def __init__(self, deadline, seq, interval, callback, args):
+        self.deadline = deadline
+        self.seq = seq
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        if self.deadline != other.deadline:
+            return self.deadline < other.deadline
+        return self.seq < other.seq
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._source_id = None
+        self._armed_deadline = None
+        self._firing = False
+        self.lateness = metrics.histogram("timer.lateness")
+
+    def __len__(self):
+        return sum(1 for timer in self._heap if not timer.cancelled)
+
+    def call_at(self, deadline, callback, *args, interval=0):
+        """在单调时钟 deadline（纳秒）时调用 callback(*args)"""
+        timer = Timer(deadline, next(self._seq), interval, callback, args)
+        heapq.heappush(self._heap, timer)
+        if not self._firing:
+            self._arm()
+        return timer
+
+    def call_later(self, delay_ms, callback, *args):
+        return self.call_at(now() + int(delay_ms * _NS_PER_MS), callback, *args)
+
+    def call_every(self, interval_ms, callback, *args):
+        """每隔 interval_ms 调用一次，callback 返回 False 时停止（与 GLib 一致）"""
+        interval = int(interval_ms * _NS_PER_MS)
+        return self.call_at(now() + interval, callback, *args, interval=interval)
+
+    def _arm(self):
+        heap = self._heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            if self._source_id is not None:
+                GLib.source_remove(self._source_id)
+                self._source_id = None
+            return
+
+        deadline = heap[0].deadline
+        if self._source_id is not None:
+            if deadline >= self._armed_deadline:
+                return
+            GLib.source_remove(self._source_id)
+        # 向上取整到毫秒，避免提前醒来后空转一次
+        delay_ms = max(0, -(-(deadline - now()) // _NS_PER_MS))
+        self._armed_deadline = deadline
+        self._source_id = GLib.timeout_add(delay_ms, self._fire)
+
+    def _fire(self):
+        self._source_id = None
+        self._firing = True
+        heap = self._heap
+        observe = self.lateness.observe
+        try:
+            current = now()
+            while heap and heap[0].deadline <= current:
+                timer = heapq.heappop(heap)
+                if timer.cancelled:
+                    continue
+                observe(current - timer.deadline)
+                try:
+                    again = timer.callback(*timer.args)
+                except Exception:
+                    # 单个回调出错不影响同批其他定时器；周期定时器就此停止
+                    logger.exception("⚠️ 定时器回调出错: %r", timer.callback)
+                    again = False
+                if timer.interval and again and not timer.cancelled:
+                    # 固定节奏；落后时跳过错过的周期而不是连续补发
+                    timer.deadline += timer.interval
+                    if timer.deadline <= current:
+                        timer.deadline = current + timer.interval
+                    heapq.heappush(heap, timer)
+                current = now()
+        finally:
+            self._firing = False
+            self._arm()
+        return False
+
+
+TIMERS = TimerQueue()
+
+call_at = TIMERS.call_at
+call_later = TIMERS.call_later
+call_every = TIMERS.call_every